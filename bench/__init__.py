@@ -0,0 +1,4 @@
+# offline benchmarks for the virtual choir pipeline, run from the top
+# level of the repository, i.e.:
+#
+#   python -m bench.audio
@@ -0,0 +1,137 @@
+# audio pipeline benchmark: generate synthetic projects (see synth.py)
+# at several sizes and time ingest, feature extraction, sync and mixing
+# the same way the pipeline does, from a cold cache.  Reports throughput
+# (x realtime, summed over tracks), peak memory and sync offset error
+# against the ground truth.
+#
+#   python -m bench.audio --tracks 8 64 --minutes 3
+
+import argparse
+import numpy as np
+import os
+import shutil
+import tempfile
+
+from lib import analyze
+from lib import loudness
+from lib import metrics
+from lib import mixer
+
+from . import common
+from . import sync
+from . import synth
+
+phases = [ "ingest", "features", "sync", "mix" ]
+
+# the mix must come out at the target loudness (or quieter, only when
+# the peak limit holds it back) and never past the peak limit
+lufs_tolerance = 1.0
+
+def check_mix(mixed):
+    y = np.array(mixed.get_array_of_samples(), dtype=np.int16)
+    lufs = loudness.integrated(y.reshape(-1, mixed.channels), mixed.frame_rate)
+    peak = int(np.max(np.abs(y.astype(np.int32))))
+    if peak > mixer.peak_limit:
+        raise RuntimeError("mix peak %d is over the limit %d" % (peak, mixer.peak_limit))
+    limited = peak >= 0.99 * mixer.peak_limit
+    if lufs > mixer.target_lufs + lufs_tolerance \
+       or (lufs < mixer.target_lufs - lufs_tolerance and not limited):
+        raise RuntimeError("mix loudness %.1f LUFS, target %.1f LUFS (peak %d)"
+                           % (lufs, mixer.target_lufs, peak))
+    return lufs, peak
+
+def run_case(project, jobs, strategy):
+    group = analyze.SampleGroup(project)
+    group.jobs = jobs
+    with metrics.stage("ingest"):
+        group.scan()
+        group.load_samples()
+    audio_sec = sum([ len(s) for s in group.sample_list ]) / 1000
+    with metrics.stage("features"):
+        group.compute_raw()
+        group.compute_onset()
+        group.compute_intensities()
+        group.compute_clarities()
+        group.compute_envelopes()
+        group.compute_loudness()
+    with metrics.stage("sync"):
+        sync.strategies[strategy](group)
+    offsets = {}
+    for i, name in enumerate(group.name_list):
+        offsets[os.path.basename(name)] = group.offset_list[i]
+    with metrics.stage("mix"):
+        group.clean_noise(clean=0.25)
+        sync_offsets = { name: { "offset": offsets[name] } for name in offsets }
+        mixed = mixer.combine(group, sync_offsets, [], pan_range=0.1,
+                              suppress_silent_zones=True)
+    mix_lufs, mix_peak = check_mix(mixed)
+    times = {}
+    for r in metrics.drain():
+        if r["stage"] in phases:
+            times[r["stage"]] = r["wall"]
+    return { "audio_sec": audio_sec, "times": times, "offsets": offsets,
+             "mix_lufs": mix_lufs, "mix_peak": mix_peak,
+             "peak_rss_mb": metrics.peak_rss_mb() }
+
+def main():
+    parser = argparse.ArgumentParser(description='audio pipeline benchmark')
+    parser.add_argument('--tracks', type=int, nargs='+', default=[8, 64, 256],
+                        help='project sizes (number of tracks)')
+    parser.add_argument('--minutes', type=float, nargs='+', default=[3, 10],
+                        help='song lengths')
+    parser.add_argument('--sync', default='clarity', choices=list(sync.strategies),
+                        help='sync strategy (see bench/sync.py)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='per track parallelism (as in the pipeline)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), "vc-bench-audio"),
+                        help='where generated projects are kept (reused between runs)')
+    parser.add_argument('--output', default='bench-audio.json',
+                        help='machine readable results')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.workdir):
+        os.makedirs(args.workdir)
+    results = []
+    rows = []
+    for minutes in args.minutes:
+        for tracks in args.tracks:
+            project = os.path.join(args.workdir, "t%d-m%g-s%d" % (tracks, minutes, args.seed))
+            print("generating:", project)
+            # (in a child process too, so the generator's memory doesn't
+            # count against the case)
+            truth = common.isolated(project + "-synth.log",
+                                    synth.make_project, project,
+                                    tracks, minutes, args.seed)
+            if truth is None:
+                continue
+            # always start from a cold cache
+            shutil.rmtree(os.path.join(project, "cache"), ignore_errors=True)
+            print("running:", project)
+            result = common.isolated(project + ".log", run_case,
+                                     project, args.jobs, args.sync)
+            if result is None:
+                continue
+            errors = list(synth.offset_errors(truth, result["offsets"]).values())
+            if not len(errors):
+                errors = [ float("nan") ]
+            total = sum(result["times"].values())
+            result.update( { "tracks": tracks, "minutes": minutes,
+                             "sync": args.sync, "jobs": args.jobs,
+                             "realtime": result["audio_sec"] / total,
+                             "errors": errors } )
+            results.append(result)
+            rows.append( [ tracks, minutes ]
+                         + [ result["times"][p] for p in phases ]
+                         + [ total, result["realtime"],
+                             result["peak_rss_mb"],
+                             result["mix_lufs"],
+                             1000 * float(np.median(errors)),
+                             1000 * float(np.max(errors)) ] )
+    common.print_table( [ "tracks", "min" ] + [ p + " s" for p in phases ]
+                        + [ "total s", "x realtime", "peak MB", "mix LUFS",
+                            "err med ms", "err max ms" ], rows )
+    common.save(args.output, results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# shared benchmark plumbing: run each case in its own (forked) process so
+# peak memory is per case and pipeline chatter goes to a log file, and
+# print plain text result tables.
+
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import traceback
+
+from lib import logger
+
+# run func(*args, **kwargs) in a child process with stdout/stderr sent
+# to log_file, returns the result (or None if the case failed)
+def isolated(log_file, func, *args, **kwargs):
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    proc = ctx.Process(target=child, args=(results, log_file, func, args, kwargs))
+    proc.start()
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            if not proc.is_alive():
+                # killed (out of memory?) before it could report
+                result = { "error": "exit code %s" % proc.exitcode }
+    proc.join()
+    if "error" in result:
+        print("case failed (see %s):" % log_file, result["error"])
+        return None
+    return result["result"]
+
+def child(results, log_file, func, args, kwargs):
+    fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    logger.init(None)
+    try:
+        results.put( { "result": func(*args, **kwargs) } )
+    except BaseException as e:
+        traceback.print_exc()
+        results.put( { "error": repr(e) } )
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+# rows are lists of values, floats get 2 decimals
+def print_table(header, rows):
+    cells = [ header ]
+    for row in rows:
+        cells.append([ ("%.2f" % v) if isinstance(v, float) else str(v)
+                       for v in row ])
+    widths = [ max([len(r[i]) for r in cells]) for i in range(len(header)) ]
+    for j, row in enumerate(cells):
+        print("  ".join([ c.rjust(w) for c, w in zip(row, widths) ]))
+        if j == 0:
+            print("  ".join([ "-" * w for w in widths ]))
+
+def save(output, results):
+    with open(output, "w") as fp:
+        json.dump(results, fp, indent=4)
+    print("results:", output)
@@ -0,0 +1,183 @@
+# video render benchmark: generate test pattern input videos with the
+# ffmpeg lavfi sources (a mix of portrait and landscape, 24/30/60 fps,
+# non square sample aspect ratios and sideways recordings that need a
+# rotate hint) and time video.render_combined_video per output
+# resolution, crop mode and tile count.  Reports frames per second
+# overall and split into the decode, shape, composite and encode phases
+# of the render loop.
+#
+#   python -m bench.render --resolutions 720p 1080p --tiles 4 16
+
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+
+from lib import metrics
+from lib import video
+
+from . import common
+
+rates = [ 24, 30, 60 ]
+phases = [ "decode", "shape", "composite", "preview", "encode" ]
+
+# input variations by index: (display w, display h, fps, sar, rotate)
+def variant(i, size):
+    (long, short) = size
+    if i % 2 == 0:
+        (w, h) = (short, long)  # portrait (phones)
+    else:
+        (w, h) = (long, short)
+    fps = rates[i % len(rates)]
+    sar = "1:1"
+    if i % 5 == 3:
+        sar = "4:3"
+    elif i % 5 == 4:
+        sar = "3:4"
+    rotate = 0
+    if i % 7 == 5:
+        rotate = 90
+    elif i % 7 == 6:
+        rotate = 270
+    return w, h, fps, sar, rotate
+
+# write one test pattern video (with a tone so it looks like a real
+# submission.)  Stored sideways when a rotate hint is needed and
+# squeezed/stretched by the sample aspect ratio.
+def make_video(path, w, h, fps, sar, rotate, seconds):
+    if rotate in [ 90, 270 ]:
+        (w, h) = (h, w)
+    (num, den) = [ int(x) for x in sar.split(":") ]
+    store_w = int(round(w * den / num / 2)) * 2
+    command = [ "ffmpeg", "-y", "-loglevel", "error",
+                "-f", "lavfi",
+                "-i", "testsrc2=size=%dx%d:rate=%d:duration=%g" % (store_w, h, fps, seconds),
+                "-f", "lavfi",
+                "-i", "sine=frequency=440:duration=%g" % seconds,
+                "-vf", "setsar=%s" % sar,
+                "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-shortest", path ]
+    result = subprocess.run(command)
+    if result.returncode != 0:
+        print("ffmpeg failed making:", path)
+        return False
+    return True
+
+# a face box in the upper middle of the (rotated, display size) frame,
+# sampled like video_faces.find_faces() does, so the face crop mode
+# has something to work with without running face detection
+def fake_face(w, h, seconds):
+    size = 0.3 * min(w, h)
+    l = 0.5 * (w - size)
+    t = 0.3 * (h - size)
+    data = []
+    for i in range(10):
+        data.append( { "time": i * seconds / 10,
+                       "left": l, "right": l + size,
+                       "top": t, "bottom": t + size,
+                       "count": i + 1, "miss": 0 } )
+    return data
+
+# generate (or reuse) the input videos, returns names and hints
+def make_inputs(project, count, size, seconds):
+    results_dir = os.path.join(project, "results")
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+    names = []
+    hints = {}
+    faces = {}
+    rotations = {}
+    for i in range(count):
+        (w, h, fps, sar, rotate) = variant(i, size)
+        name = "video-%03d-%dx%d-%dfps-sar%s-rot%d.mp4" % (i, w, h, fps, sar.replace(":", "_"), rotate)
+        path = os.path.join(project, name)
+        if not os.path.exists(path):
+            print("generating:", name)
+            if not make_video(path, w, h, fps, sar, rotate, seconds):
+                continue
+        names.append(name)
+        if rotate:
+            hints[name] = { "rotate": rotate }
+        faces[name] = fake_face(w, h, seconds)
+        rotations[name] = rotate
+    # pretend face detection already ran (with the rotate hints, else
+    # find_faces() runs it again)
+    with open(os.path.join(results_dir, "faces.json"), "w") as fp:
+        json.dump(faces, fp, indent=4)
+    with open(os.path.join(results_dir, "faces-rotate.json"), "w") as fp:
+        json.dump(rotations, fp, indent=4)
+    return names, hints
+
+def run_case(project, names, hints, resolution, crop):
+    results_dir = os.path.join(project, "results")
+    offsets = [ 0.0 ] * len(names)
+    video.render_combined_video(project, resolution, results_dir, names,
+                                offsets, hints=hints, crop=crop)
+    for r in metrics.drain():
+        if r["stage"] == "render_combined_video":
+            return { "wall": r["wall"], "cpu": r["process_cpu"],
+                     "frames": r.get("frames", 0),
+                     "phases": r.get("phases", {}),
+                     "peak_rss_mb": r["process_peak_rss_mb"] }
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description='video render benchmark')
+    parser.add_argument('--resolutions', nargs='+',
+                        default=['480p', '720p', '1080p', '1440p'],
+                        choices=['480p', '720p', '1080p', '1440p'])
+    parser.add_argument('--crops', nargs='+', default=['face', 'fit', 'none'],
+                        choices=['face', 'face-wide', 'fit', 'none'])
+    parser.add_argument('--tiles', type=int, nargs='+', default=[4, 16, 36],
+                        help='number of input videos in the grid')
+    parser.add_argument('--seconds', type=float, default=10,
+                        help='input video length (the render adds 4 sec of credits)')
+    parser.add_argument('--source', default='1280x720',
+                        help='input video size (landscape, portrait inputs are rotated)')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), "vc-bench-render"),
+                        help='where generated videos are kept (reused between runs)')
+    parser.add_argument('--output', default='bench-render.json',
+                        help='machine readable results')
+    args = parser.parse_args()
+
+    (long, short) = [ int(x) for x in args.source.split("x") ]
+    project = os.path.join(args.workdir, "%s-%gs" % (args.source, args.seconds))
+    if not os.path.exists(project):
+        os.makedirs(project)
+    names, hints = make_inputs(project, max(args.tiles), (long, short),
+                               args.seconds)
+
+    results = []
+    rows = []
+    for resolution in args.resolutions:
+        for crop in args.crops:
+            for tiles in args.tiles:
+                print("render:", resolution, crop, tiles)
+                log_file = os.path.join(args.workdir, "%s-%s-%d.log" % (resolution, crop, tiles))
+                result = common.isolated(log_file, run_case, project,
+                                         names[:tiles], hints, resolution,
+                                         crop)
+                if result is None or not result["frames"]:
+                    continue
+                frames = result["frames"]
+                result.update( { "resolution": resolution, "crop": crop,
+                                 "tiles": tiles } )
+                results.append(result)
+                row = [ resolution, crop, tiles, frames,
+                        frames / result["wall"] ]
+                for p in phases:
+                    t = result["phases"].get(p, 0.0)
+                    if t > 0:
+                        row.append(frames / t)
+                    else:
+                        row.append("-")
+                row += [ result["wall"], result["peak_rss_mb"] ]
+                rows.append(row)
+    common.print_table( [ "res", "crop", "tiles", "frames", "fps" ]
+                        + [ p + " fps" for p in phases ]
+                        + [ "wall s", "peak MB" ], rows )
+    common.save(args.output, results)
+
+if __name__ == "__main__":
+    main()
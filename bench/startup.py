@@ -0,0 +1,84 @@
+# cold start check: time fresh python processes that load the pipeline
+# (what every daemon job launch and quick remix pays before any work
+# starts), make sure none of the heavy modules sneak back in at import
+# time, and show the slowest imports.  Exits non zero when the target
+# is missed.
+#
+#   python -m bench.startup --target 0.5
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# only the stages that need these should import them
+heavy = [ "librosa", "matplotlib", "scipy.signal", "cv2", "skvideo", "dlib" ]
+
+top_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+commands = {
+    "import pipeline": [ sys.executable, "-c", "from lib import pipeline" ],
+    "sync-tracks --help": [ sys.executable, "sync-tracks.py", "--help" ],
+}
+
+def time_command(command, runs):
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=top_dir, stdout=subprocess.DEVNULL,
+                       check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+# heavy modules loaded by importing the pipeline
+def heavy_imports():
+    code = "import sys; from lib import pipeline; print(' '.join(sys.modules))"
+    result = subprocess.run([ sys.executable, "-c", code ], cwd=top_dir,
+                            stdout=subprocess.PIPE, check=True, text=True)
+    modules = result.stdout.split()
+    return [ m for m in heavy if m in modules ]
+
+# slowest imports (cumulative) according to python -X importtime
+def slowest_imports(count):
+    result = subprocess.run([ sys.executable, "-X", "importtime", "-c",
+                              "from lib import pipeline" ],
+                            cwd=top_dir, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        imports.append( (int(parts[1]), parts[2].rstrip()) )
+    imports.sort(reverse=True)
+    return imports[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description='cold start benchmark')
+    parser.add_argument('--target', type=float, default=0.5,
+                        help='median start up time to stay under (sec)')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    ok = True
+    for name in commands:
+        times = time_command(commands[name], args.runs)
+        median = statistics.median(times)
+        print("%-20s first: %.2fs median: %.2fs (target %.2fs)" %
+              (name, times[0], median, args.target))
+        if median > args.target:
+            ok = False
+    loaded = heavy_imports()
+    if len(loaded):
+        print("heavy modules imported at start up:", loaded)
+        ok = False
+    print("slowest imports (cumulative):")
+    for (usec, name) in slowest_imports(10):
+        print("  %7.3fs %s" % (usec / 1000000, name))
+    if not ok:
+        print("start up target missed")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# sync accuracy versus speed: run every registered sync strategy over
+# generated scenarios (clean, clock drift, long silences, reference
+# bleed, a wrong file) and any recorded fixture projects, and tabulate
+# median/worst offset error, failure rate and wall time.
+#
+#   python -m bench.sync --tracks 8 32 --fixtures ~/fixtures/*/
+#
+# A recorded fixture is a project directory with a <dir>.truth.json
+# next to it: { "offsets": { "track.wav": sec, ... }, "wrong": [ ... ] }
+
+import argparse
+import numpy as np
+import os
+import tempfile
+
+from lib import analyze
+from lib import metrics
+
+from . import common
+from . import synth
+
+# name -> func(group), leaves the offsets in group.offset_list.  New
+# strategies just need to register here.
+strategies = {}
+
+def register(name):
+    def decorator(func):
+        strategies[name] = func
+        return func
+    return decorator
+
+@register("clarity")
+def clarity(group):
+    group.correlate_mutual(group.clarity_list)
+
+@register("clap")
+def clap(group):
+    group.sync_by_claps()
+
+# the declared reference track (first track by default)
+@register("reference")
+def reference(group):
+    ref_index = 0
+    for i, name in enumerate(group.name_list):
+        if "reference" in name.lower():
+            ref_index = i
+    group.correlate_to_reference(ref_index, group.clarity_list)
+
+scenarios = {
+    "clean": { "gap_prob": 0.0 },
+    "drift": { "drift_ppm": 100 },
+    "silence": { "gap_prob": 1.0 },
+    "bleed": { "bleed": 0.3 },
+    "wrong-file": { "wrong": 1 },
+}
+
+# the features every strategy needs
+def load_features(project, jobs):
+    group = analyze.SampleGroup(project)
+    group.jobs = jobs
+    group.scan()
+    group.load_samples()
+    group.compute_raw()
+    group.compute_onset()
+    group.compute_intensities()
+    group.compute_clarities()
+    return group
+
+# run the strategies on one project, features are computed once and
+# shared (not counted in the strategy times)
+def run_case(project, jobs, names):
+    with metrics.stage("features") as record:
+        group = load_features(project, jobs)
+    results = { "features": None, "strategies": {} }
+    intensities = group.intensity_list
+    for name in names:
+        # some strategies scribble on the feature arrays
+        group.intensity_list = [ x.copy() for x in intensities ]
+        group.offset_list = []
+        try:
+            with metrics.stage(name) as r:
+                strategies[name](group)
+            offsets = {}
+            for i, track in enumerate(group.name_list):
+                offsets[os.path.basename(track)] = group.offset_list[i]
+            results["strategies"][name] = { "offsets": offsets,
+                                            "wall": r["wall"] }
+        except Exception as e:
+            print("strategy failed:", name, repr(e))
+            results["strategies"][name] = { "offsets": {}, "wall": 0.0,
+                                            "error": repr(e) }
+    results["features"] = record["wall"]
+    return results
+
+# error stats for one strategy on one project
+def score(truth, result, tolerance):
+    wrong = truth.get("wrong", [])
+    count = len([ n for n in truth["offsets"] if not n in wrong ])
+    errors = list(synth.offset_errors(truth, result["offsets"]).values())
+    if not len(errors):
+        return float("nan"), float("nan"), 1.0
+    failed = len([ e for e in errors if e > tolerance ]) + count - len(errors)
+    return float(np.median(errors)), float(np.max(errors)), failed / count
+
+def main():
+    parser = argparse.ArgumentParser(description='sync strategy benchmark')
+    parser.add_argument('--strategies', nargs='+', default=list(strategies),
+                        choices=list(strategies))
+    parser.add_argument('--scenarios', nargs='+', default=list(scenarios),
+                        choices=list(scenarios))
+    parser.add_argument('--tracks', type=int, nargs='+', default=[8, 32],
+                        help='generated project sizes')
+    parser.add_argument('--minutes', type=float, default=3)
+    parser.add_argument('--fixtures', nargs='*', default=[],
+                        help='recorded project directories (with a <dir>.truth.json)')
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='offset error (sec) that counts as a failed track')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), "vc-bench-sync"),
+                        help='where generated projects are kept (reused between runs)')
+    parser.add_argument('--output', default='bench-sync.json',
+                        help='machine readable results')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.workdir):
+        os.makedirs(args.workdir)
+
+    # (label, tracks, project dir)
+    cases = []
+    for scenario in args.scenarios:
+        for tracks in args.tracks:
+            project = os.path.join(args.workdir, "%s-t%d-m%g-s%d" % (scenario, tracks, args.minutes, args.seed))
+            print("generating:", project)
+            truth = common.isolated(project + "-synth.log",
+                                    synth.make_project, project,
+                                    tracks=tracks, minutes=args.minutes,
+                                    seed=args.seed, **scenarios[scenario])
+            if not truth is None:
+                cases.append( (scenario, tracks, project) )
+    for fixture in args.fixtures:
+        fixture = fixture.rstrip("/")
+        truth = synth.load_truth(fixture)
+        cases.append( (os.path.basename(fixture), len(truth["offsets"]), fixture) )
+
+    results = []
+    rows = []
+    for (label, tracks, project) in cases:
+        truth = synth.load_truth(project)
+        print("running:", project)
+        result = common.isolated(project + ".log", run_case, project,
+                                 args.jobs, args.strategies)
+        if result is None:
+            continue
+        for name in args.strategies:
+            r = result["strategies"][name]
+            median, worst, fail = score(truth, r, args.tolerance)
+            results.append( { "project": label, "tracks": tracks,
+                              "strategy": name, "median": median,
+                              "worst": worst, "failure_rate": fail,
+                              "wall": r["wall"],
+                              "features": result["features"],
+                              "offsets": r["offsets"] } )
+            rows.append( [ label, tracks, name, 1000 * median,
+                           1000 * worst, "%.0f%%" % (100 * fail),
+                           r["wall"], result["features"] ] )
+    common.print_table( [ "project", "tracks", "strategy", "err med ms",
+                          "err max ms", "failed", "sync s",
+                          "features s" ], rows )
+    common.save(args.output, results)
+
+if __name__ == "__main__":
+    main()
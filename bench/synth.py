@@ -0,0 +1,193 @@
+# synthetic choir projects with known ground truth.  Every voice sings
+# (a transposed part of) the same randomly generated song with harmonic
+# tones, vibrato and a noise floor.  Each track gets a random lead in
+# (so the true sync offset is known), a clap count in, optional silent
+# gaps, and one of several sample rates.
+
+import json
+import math
+import numpy as np
+import os
+import wave
+
+tempo = 90                      # bpm
+count_in = 4                    # claps before the first note
+rates = [ 48000, 44100, 32000, 22050 ]
+parts = [ 0, 4, -5, -8 ]        # semitones relative to the melody
+
+# random melody as (start, length, midi note) in seconds, starting
+# after the count in
+def song(minutes, seed):
+    rng = np.random.default_rng(seed)
+    beat = 60.0 / tempo
+    notes = []
+    t = (count_in + 1) * beat
+    pitch = 60
+    while t < minutes * 60:
+        pitch = int(np.clip(pitch + rng.integers(-4, 5), 55, 67))
+        length = rng.choice([0.5, 1, 1, 1, 2, 3]) * beat
+        if rng.random() < 0.1:
+            # rest
+            notes.append( (t, length, None) )
+        else:
+            notes.append( (t, length, pitch) )
+        t += length
+    return notes
+
+# a short decaying noise burst
+def clap(rate, rng):
+    n = int(0.03 * rate)
+    return rng.normal(0, 0.5, n) * np.exp(-np.arange(n) / (0.005 * rate))
+
+# render one voice as a float array (mono, -1 to 1) at the given rate.
+# Song time starts after lead_in seconds of silence (plus noise), drift
+# stretches the song time (ppm), gaps are (start, end) song times where
+# the singer drops out.
+def voice(notes, rate, lead_in=0.0, tail=1.0, part=0, seed=0,
+          drift_ppm=0, gaps=[], noise=0.003, claps=True):
+    rng = np.random.default_rng(seed)
+    stretch = 1.0 + drift_ppm * 1e-6
+    song_len = notes[-1][0] + notes[-1][1]
+    total = int(round((lead_in + song_len * stretch + tail) * rate))
+    y = np.zeros(total, dtype=np.float32)
+
+    # sample positions of the notes (song time to track time)
+    starts = np.array([n[0] for n in notes])
+    lengths = np.array([n[1] for n in notes])
+    start = np.round((lead_in + starts * stretch) * rate).astype(np.int64)
+    length = np.round(lengths * stretch * rate).astype(np.int64)
+    pitch = np.array([ -1000 if n[2] is None else n[2] for n in notes ])
+    first = start[0]
+    last = min(start[-1] + length[-1], total)
+
+    # fundamental with a little detune and vibrato, then harmonics,
+    # rendered in blocks to keep the temporaries small
+    detune = rng.uniform(-0.003, 0.003)
+    amps = [ rng.uniform(0.3, 1.0) / k for k in range(1, 6) ]
+    attack = 0.04 * rate
+    release = 0.06 * rate
+    phase0 = 0.0
+    block = 10 * rate
+    for b0 in range(first, last, block):
+        n = np.arange(b0, min(b0 + block, last))
+        index = np.searchsorted(start, n, side="right") - 1
+        pos = n - start[index]
+        freq = 440.0 * np.power(2.0, (pitch[index] + part - 69) / 12.0)
+        freq *= (1 + detune) * (1 + 0.004 * np.sin(2 * math.pi * 5.5 * n / rate))
+        phase = phase0 + np.cumsum(2 * math.pi * freq / rate)
+        phase0 = phase[-1]
+        tone = np.zeros(len(n))
+        for k, a in enumerate(amps):
+            tone += np.sin((k + 1) * phase) * a
+        # per note envelope (rests are silent)
+        env = np.minimum(pos / attack, (length[index] - pos) / release)
+        env = np.clip(env, 0.0, 1.0)
+        env[pitch[index] < 0] = 0.0
+        y[n[0]:n[-1]+1] = 0.3 * tone * env
+    for (t0, t1) in gaps:
+        i0 = int(round((lead_in + t0 * stretch) * rate))
+        i1 = int(round((lead_in + t1 * stretch) * rate))
+        y[i0:i1] = 0.0
+
+    if claps:
+        beat = 60.0 / tempo
+        for i in range(count_in):
+            c = clap(rate, rng)
+            i0 = int(round((lead_in + i * beat * stretch) * rate))
+            y[i0:i0+len(c)] += c[:total-i0]
+
+    y += rng.normal(0, noise, total).astype(np.float32)
+    return y * rng.uniform(0.5, 1.0)
+
+def write_wav(path, y, rate):
+    y = np.clip(y, -1.0, 1.0)
+    y = (y * 32767).astype(np.int16)
+    # stereo like most phone recordings
+    y = np.repeat(y.reshape(-1, 1), 2, axis=1)
+    with wave.open(path, "wb") as fp:
+        fp.setnchannels(2)
+        fp.setsampwidth(2)
+        fp.setframerate(rate)
+        fp.writeframes(y.tobytes())
+
+# the ground truth lives next to the project directory (a .json inside
+# would be taken for a sync file)
+def truth_name(path):
+    return path.rstrip("/") + ".truth.json"
+
+def load_truth(path):
+    with open(truth_name(path), "r") as fp:
+        return json.load(fp)
+
+# write a project directory of synthetic tracks plus the truth file.
+# The true offset of a track (as used by the mixer) is minus its lead
+# in.
+#   gap_prob: chance a track has silent gaps
+#   drift_ppm: max clock drift of a track
+#   bleed: level of the full choir reference leaking into each track
+#   wrong: number of tracks that sing a different song
+def make_project(path, tracks=8, minutes=3, seed=0, rates=rates,
+                 gap_prob=0.25, drift_ppm=0, bleed=0.0, wrong=0):
+    params = { "tracks": tracks, "minutes": minutes, "seed": seed,
+               "rates": rates, "gap_prob": gap_prob,
+               "drift_ppm": drift_ppm, "bleed": bleed, "wrong": wrong }
+    truth_file = truth_name(path)
+    if os.path.exists(truth_file):
+        truth = load_truth(path)
+        if truth["params"] == params:
+            # already generated
+            return truth
+    if not os.path.exists(path):
+        os.makedirs(path)
+    rng = np.random.default_rng(seed)
+    notes = song(minutes, seed)
+    other = song(minutes, seed + 1)
+    song_len = notes[-1][0] + notes[-1][1]
+    truth = { "params": params, "offsets": {}, "rates": {}, "wrong": [] }
+    for i in range(tracks):
+        name = "voice-%03d.wav" % i
+        rate = int(rates[i % len(rates)])
+        lead_in = rng.uniform(0.5, 4.0)
+        gaps = []
+        if rng.random() < gap_prob:
+            for j in range(rng.integers(1, 4)):
+                t0 = rng.uniform(0, song_len)
+                gaps.append( (t0, t0 + rng.uniform(5, 20)) )
+        drift = 0
+        if drift_ppm:
+            drift = rng.uniform(-drift_ppm, drift_ppm)
+        track_notes = notes
+        if i >= tracks - wrong:
+            track_notes = other
+            truth["wrong"].append(name)
+        y = voice(track_notes, rate, lead_in=lead_in,
+                  tail=rng.uniform(0.5, 2.0), part=parts[i % len(parts)],
+                  seed=seed * 1000 + i, drift_ppm=drift, gaps=gaps)
+        if bleed > 0:
+            # the reference leaks in a little ahead of the singer
+            # (singers follow what they hear)
+            latency = rng.uniform(0.05, 0.3)
+            ref = voice(notes, rate, lead_in=max(lead_in - latency, 0),
+                        tail=0, seed=seed * 1000 + 999, noise=0,
+                        claps=False)
+            n = min(len(y), len(ref))
+            y[:n] += bleed * ref[:n]
+        write_wav(os.path.join(path, name), y, rate)
+        truth["offsets"][name] = -lead_in
+        truth["rates"][name] = rate
+    with open(truth_file, "w") as fp:
+        json.dump(truth, fp, indent=4)
+    return truth
+
+# absolute offset errors (sec) of the estimated offsets (name -> sec)
+# against the truth.  Only relative alignment matters, so the median
+# error is removed first.  Wrong file tracks have no true offset.
+def offset_errors(truth, offsets):
+    names = [ name for name in truth["offsets"]
+              if name in offsets and not name in truth.get("wrong", []) ]
+    if not len(names):
+        return {}
+    err = np.array([ offsets[name] - truth["offsets"][name]
+                     for name in names ])
+    err -= np.median(err)
+    return dict(zip(names, np.abs(err).tolist()))
@@ -1,24 +1,43 @@
 # analyze audio streams (using librosa functions)
 
+# librosa, matplotlib and scipy.signal are slow to import, so they are
+# imported by the functions that need them
+
 import json
-import librosa
-import librosa.display
 import math
-import matplotlib.pyplot as plt
 import numpy as np
 import os
-from pydub import AudioSegment, scipy_effects # pip install pydub
+from pydub import AudioSegment # pip install pydub
 from pydub.playback import play
-from scipy import signal
 from subprocess import call
+import threading
 from tqdm import tqdm
 
+from . import dag
 from .logger import log
+from . import loudness
+from . import metrics
+from . import resample
 from . import scan
 
 sample_rate = 48000
 hop_length = 512
 
+# tracks spilled to the cache are (frames, channels) int16 arrays at
+# the project sample rate, turn them back into an AudioSegment
+def segment(sample):
+    if isinstance(sample, np.ndarray):
+        return AudioSegment(sample.tobytes(), frame_rate=sample_rate,
+                            sample_width=2, channels=sample.shape[1])
+    return sample
+
+# and the other way round (without a copy)
+def sample_array(sample):
+    if isinstance(sample, np.ndarray):
+        return sample
+    y = np.frombuffer(sample.raw_data, dtype=np.int16)
+    return y.reshape(-1, sample.channels)
+
 class SampleGroup():
     def __init__(self, path):
         self.path = path
@@ -32,13 +51,24 @@ class SampleGroup():
         self.offset_list = []
         self.intensity_list = []
         self.clarity_list = []
-        self.rms_list = []
+        self.loudness_list = []
         self.note_list = []
         self.envelope_list = []
         self.suppress_list = None
         self.leadin_list = []
         self.fadeout_list = []
+        self.mix_list = []
+        self.duration_list = []
         self.sync_file = None
+        # tracks processed in parallel by the per track feature steps
+        self.jobs = 1
+        # bytes of per track arrays to hold in ram (None is no limit),
+        # anything past the budget is spilled to compact memmaps in the
+        # cache, see keep()
+        self.memory_budget = None
+        self.memory_used = 0
+        self.memory_spilled = 0
+        self.memory_lock = threading.Lock()
 
     def load_all_samples_deprecated(self):
         audio_tracks, video_tracks, sync_file = scan.scan_directory(self.path)
@@ -76,34 +106,30 @@ class SampleGroup():
         cache_dir = os.path.join(self.path, "cache")
         if not os.path.exists(cache_dir):
             log("Creating:", cache_dir)
-            os.makedirs(cache_dir)
+            # sibling groups may be racing us to create it
+            os.makedirs(cache_dir, exist_ok=True)
         return cache_dir
         
-    def scan(self):
-        audio_tracks, video_tracks, sync_file = scan.scan_directory(self.path)
+    def scan(self, index=None):
+        audio_tracks, video_tracks, sync_file = scan.scan_directory(self.path, index)
         log("found audio tracks:", audio_tracks)
         self.name_list = audio_tracks
         self.video_list = video_tracks
         self.sync_file = sync_file
 
-    def filter_extremes(self, sample):
-        channels = sample.split_to_mono()
-        raws = []
-        for ch in channels:
-            raws.append( ch.get_array_of_samples() )
-        sos = signal.butter(4, [80, 4500], 'bp', fs=sample.frame_rate, output='sos')
-        filtered = []
-        for raw in raws:
-            filt = signal.sosfilt(sos, raw).astype(float)
-            max = np.max(np.abs(filt))
-            if max > 31000:
-                filt *= (31000/max)
-            #print("max:", np.max(np.abs(filt)))
-            filt = np.int16( filt )
-            seg = AudioSegment(filt.tobytes(), frame_rate=sample.frame_rate, sample_width=2, channels=1)
-            filtered.append( seg )
-        result = AudioSegment.from_mono_audiosegments(*filtered)
-        return result
+    # band pass filter a (frames, channels) block of samples, limit each
+    # channel's peak, and return the 16 bit AudioSegment
+    def filter_extremes(self, y, frame_rate):
+        from scipy import signal
+        sos = signal.butter(4, [80, 4500], 'bp', fs=frame_rate, output='sos')
+        filt = signal.sosfilt(sos, y, axis=0)
+        if len(filt):
+            max = np.max(np.abs(filt), axis=0)
+            max[max < 31000] = 31000
+            filt *= (31000/max)
+        filt = filt.astype(np.int16)
+        return AudioSegment(filt.tobytes(), frame_rate=frame_rate,
+                            sample_width=2, channels=y.shape[1])
         
     def load(self, file):
         log("loading audio track:", file)
@@ -127,82 +153,296 @@ class SampleGroup():
             sample = AudioSegment.silent(duration=10000)
         sample = sample.set_channels(2) # force samples to be stereo
         sample = sample.set_sample_width(2) # force to 2 for this project
-        sample = sample.normalize()
-        sample = sample.set_frame_rate(sample_rate)
-        sample = self.filter_extremes(sample)
-        return sample
+        # normalize, resample, and filter as one pass over a numpy block
+        y = np.frombuffer(sample.raw_data, dtype=np.int16)
+        y = y.reshape(-1, 2).astype(np.float32)
+        if len(y):
+            peak = np.max(np.abs(y))
+            if peak > 0:
+                # same 0.1 dB headroom as pydub's normalize()
+                y *= 32768 * math.pow(10, -0.1/20) / peak
+        y = resample.resample(y, sample.frame_rate, sample_rate)
+        return self.filter_extremes(y, sample_rate)
+
+    # subgroup mixes are handed up to the parent group as a lossless
+    # int16 array (the mp3 next to it is only for the humans)
+    def lossless_name(self, file):
+        name = os.path.basename(file)
+        basename, ext = os.path.splitext(name)
+        return os.path.join(self.path, "cache", basename + "-lossless.npy")
+
+    # whether the subgroup mix file was only remixed (same offsets and
+    # length as the mix before it, so the offsets this group found for
+    # it still hold), see save_lossless_mix()
+    def remix_name(self, file):
+        name = os.path.basename(file)
+        basename, ext = os.path.splitext(name)
+        return os.path.join(self.path, "cache", basename + "-remix.json")
+
+    def is_remixed(self, file):
+        remix_name = self.remix_name(file)
+        if not self.is_newer(remix_name, os.path.join(self.path, file)):
+            return False
+        with open(remix_name, "r") as fp:
+            return json.load(fp).get("remix", False)
+
+    def load_lossless(self, lossless_name):
+        with open(lossless_name, "rb") as f:
+            y = np.load(f)
+        return AudioSegment(y.tobytes(), frame_rate=sample_rate,
+                            sample_width=2, channels=y.shape[1])
+
+    # the cached file that derived features of track i depend on
+    def source_name(self, i):
+        if len(self.mix_list) and self.mix_list[i]:
+            return self.lossless_name(self.name_list[i])
+        name = os.path.basename(self.name_list[i])
+        basename, ext = os.path.splitext(name)
+        return os.path.join(self.path, "cache", basename + "-canon.mp3")
+
+    def cache_name(self, i, suffix):
+        name = os.path.basename(self.name_list[i])
+        basename, ext = os.path.splitext(name)
+        return os.path.join(self.path, "cache", basename + suffix)
+
+    # count nbytes against the memory budget, returns false (and counts
+    # them as spilled) if they don't fit
+    def reserve(self, nbytes):
+        with self.memory_lock:
+            if self.memory_used + nbytes <= self.memory_budget:
+                self.memory_used += nbytes
+                return True
+            self.memory_spilled += nbytes
+            return False
+
+    # hold on to a per track array: as is while it fits in the memory
+    # budget, otherwise as a compact (dtype) copy in the cache, mapped
+    # copy-on-write so the sync code can still scribble on it.  saved
+    # means the cache file already holds exactly this data.
+    def keep(self, y, cache_name, dtype, saved=False):
+        if self.memory_budget is None:
+            return y
+        if isinstance(y, np.memmap):
+            # already mapped from a file (costs no budget)
+            return y
+        y = np.asarray(y)
+        if self.reserve(y.nbytes):
+            return y
+        if not saved:
+            np.save(cache_name, y.astype(dtype))
+        return np.load(cache_name, mmap_mode="c")
+
+    # same for an AudioSegment, spilled as an int16 memmap (use
+    # get_sample() or segment() to read it back)
+    def keep_sample(self, sample, cache_name):
+        if self.memory_budget is None:
+            return sample
+        if self.reserve(len(sample.raw_data)):
+            return sample
+        np.save(cache_name, sample_array(sample))
+        return np.load(cache_name, mmap_mode="r")
+
+    # what is left of the memory budget in bytes (None is no limit)
+    def budget_left(self):
+        if self.memory_budget is None:
+            return None
+        with self.memory_lock:
+            return max(self.memory_budget - self.memory_used, 0)
+
+    # give back the budget of arrays kept in ram
+    def forget(self, y):
+        if self.memory_budget is None or y is None:
+            return
+        if isinstance(y, np.memmap):
+            return
+        if isinstance(y, AudioSegment):
+            nbytes = len(y.raw_data)
+        else:
+            nbytes = np.asarray(y).nbytes
+        with self.memory_lock:
+            self.memory_used -= nbytes
+
+    # drop a per track list that later stages don't need any more
+    def release(self, name):
+        for y in getattr(self, name):
+            self.forget(y)
+        setattr(self, name, [])
+
+    # what a remix needs to know about the last full run of this group
+    # (the hints it used and the track lengths), see load_state()
+    def state_name(self):
+        return os.path.join(self.path, "cache", "mix-state.json")
 
+    def save_state(self, hints):
+        durations = {}
+        for i, file in enumerate(self.name_list):
+            durations[os.path.basename(file)] = self.duration_list[i]
+        with open(self.state_name(), "w") as fp:
+            json.dump( { "hints": hints, "durations": durations }, fp,
+                       indent=4)
+
+    def read_state(self):
+        if not os.path.exists(self.state_name()):
+            return None
+        with open(self.state_name(), "r") as fp:
+            return json.load(fp)
+
+    # set up the sample lists from a saved state instead of loading every
+    # track (the mixer loads the cleaned tracks from the cache itself and
+    # only needs the lossless subgroup mixes.)  Call after scan().
+    # Returns false if the state doesn't cover all the tracks.
+    def load_state(self, state):
+        self.sample_list = []
+        self.mix_list = []
+        self.duration_list = []
+        for i, file in enumerate(self.name_list):
+            name = os.path.basename(file)
+            if not name in state["durations"]:
+                return False
+            lossless_name = self.lossless_name(file)
+            if self.is_newer(lossless_name, os.path.join(self.path, file)):
+                sample = self.load_lossless(lossless_name)
+                self.sample_list.append( self.keep_sample(sample, self.cache_name(i, "-samples.npy")) )
+                self.mix_list.append(True)
+            else:
+                self.sample_list.append(None)
+                self.mix_list.append(False)
+            self.duration_list.append(state["durations"][name])
+        return True
+
+    # track i as kept (an AudioSegment or a spilled memmap), loaded now
+    # if load_state() left it out
+    def track_sample(self, i):
+        if self.sample_list[i] is None:
+            (sample, mix, ms) = self.load_sample(i)
+            self.sample_list[i] = sample
+        return self.sample_list[i]
+
+    # track i as an AudioSegment (rebuilt from the memmap when spilled,
+    # so don't hang on to it)
+    def get_sample(self, i):
+        return segment(self.track_sample(i))
+
+    def set_sample(self, i, sample, suffix):
+        self.forget(self.sample_list[i])
+        self.sample_list[i] = self.keep_sample(sample, self.cache_name(i, suffix))
+
+    @metrics.timed("load_samples")
     def load_samples(self):
         cache_dir = self.check_cache()
         
         log("Load original samples and convert to canonical form...")
-        self.sample_list = []
-        for i, file in enumerate(self.name_list):
+        results = dag.map(self.load_sample, range(len(self.name_list)),
+                          self.jobs)
+        self.sample_list = [ sample for (sample, mix, ms) in results ]
+        self.mix_list = [ mix for (sample, mix, ms) in results ]
+        self.duration_list = [ ms for (sample, mix, ms) in results ]
+
+    # returns (sample, is lossless subgroup mix, duration in ms)
+    def load_sample(self, i):
+        with metrics.stage("load_samples.track", track=self.name_list[i]):
             # check cache
+            file = self.name_list[i]
             fullname = os.path.join(self.path, file)
             name = os.path.basename(file)
             basename, ext = os.path.splitext(name)
             canon_name = os.path.join(self.path, "cache",
                                       basename + "-canon.mp3")
+            lossless_name = self.lossless_name(file)
+            if self.is_newer(lossless_name, fullname):
+                # subgroup mix: already filtered, cleaned and mixed
+                # down, so skip the decode/filter/canonical steps
+                log("using lossless subgroup mix:", lossless_name)
+                metrics.cache(hit=True)
+                sample = self.load_lossless(lossless_name)
+                return self.keep_sample(sample, self.cache_name(i, "-samples.npy")), True, len(sample)
+            metrics.cache(hit=False)
             sample = self.load(file)
-            self.sample_list.append(sample)
             if not self.is_newer(canon_name, fullname):
                 # save canonical version of audio in cache
                 sample.export(canon_name, format="mp3")
-        
+            return self.keep_sample(sample, self.cache_name(i, "-samples.npy")), False, len(sample)
+
+    @metrics.timed("compute_raw")
     def compute_raw(self):
         cache_dir = self.check_cache()
         
         log("Generating raw signals...")
-        self.raw_list = []
-        for i, file in enumerate(self.name_list):
+        self.raw_list = dag.map(self.compute_raw_track,
+                                range(len(self.name_list)), self.jobs)
+
+    def compute_raw_track(self, i):
+        with metrics.stage("compute_raw.track", track=self.name_list[i]):
             # check cache
+            file = self.name_list[i]
             fullname = os.path.join(self.path, file)
             name = os.path.basename(file)
             basename, ext = os.path.splitext(name)
-            canon_name = os.path.join(self.path, "cache",
-                                      basename + "-canon.mp3")
             mono_name = os.path.join(self.path, "cache",
                                      basename + "-monofilt.npy")
-            if self.is_newer(mono_name, canon_name):
+            if self.is_newer(mono_name, self.source_name(i)):
                 # print("loading from cache:", mono_name)
+                metrics.cache(hit=True)
+                if self.memory_budget is not None:
+                    return self.keep(np.load(mono_name, mmap_mode="r"),
+                                     mono_name, np.int16, saved=True)
                 with open(mono_name, "rb") as f:
                     raw = np.load(f)
             else:
                 # compute
+                metrics.cache(hit=False)
+                from pydub import scipy_effects
                 log("Generating mono/filtered sample:", mono_name)
-                sample = self.sample_list[i]
+                sample = self.get_sample(i)
                 mono = sample.set_channels(1) # convert to mono
                 mono_filt = scipy_effects.band_pass_filter(mono, 130, 523) #C3-C5
                 raw = mono_filt.get_array_of_samples()
                 # save in cache
                 with open(mono_name, "wb") as f:
                     np.save(f, raw)
-            self.raw_list.append(raw)
-            
+                if self.memory_budget is not None:
+                    return self.keep(np.frombuffer(raw, dtype=np.int16),
+                                     mono_name, np.int16, saved=True)
+            return raw
+
+    @metrics.timed("compute_onset")
     def compute_onset(self):
         print("Computing onset envelope and times...")
-        self.onset_list = []
+        results = dag.map(self.compute_onset_track, self.raw_list, self.jobs)
+        self.onset_list = [ oenv for (oenv, t) in results ]
+        self.time_list = [ t for (oenv, t) in results ]
+        if self.memory_budget is not None:
+            # only the plots look at these
+            self.onset_list = []
+
+    # the frame times compute_onset() finds, without the onset work
+    def compute_times(self):
         self.time_list = []
-        for i, raw in enumerate(tqdm(self.raw_list)):
-            # compute onset envelopes
-            oenv = librosa.onset.onset_strength(y=np.array(raw).astype('float'),
-                                                sr=sample_rate,
-                                                hop_length=hop_length)
-            t = librosa.times_like(oenv, sr=sample_rate, hop_length=hop_length)
-            self.onset_list.append(oenv)
-            self.time_list.append(t)
+        for raw in self.raw_list:
+            frames = 1 + len(raw) // hop_length
+            self.time_list.append( np.arange(frames) * hop_length / sample_rate )
+
+    def compute_onset_track(self, raw):
+        import librosa
+        # compute onset envelopes
+        oenv = librosa.onset.onset_strength(y=np.array(raw).astype('float'),
+                                            sr=sample_rate,
+                                            hop_length=hop_length)
+        t = librosa.times_like(oenv, sr=sample_rate, hop_length=hop_length)
+        return oenv, t
             
+    @metrics.timed("compute_intensities")
     def compute_intensities(self):
         print("Computing intensities...")
         self.intensity_list = []
-        for raw in tqdm(self.raw_list):
+        for i, raw in enumerate(tqdm(self.raw_list)):
             intensity = []
             base = 0
             while base < len(raw):
                 intensity.append(np.max(np.abs(raw[base:base+hop_length])))
                 base += hop_length
-            self.intensity_list.append( np.array(intensity).astype('float') )
+            intensity = np.array(intensity).astype('float')
+            self.intensity_list.append( self.keep(intensity, self.cache_name(i, "-intensity.npy"), np.float32) )
 
     # return true if a is newer or same age than b, else false
     def is_newer(self, a, b):
@@ -215,14 +455,32 @@ class SampleGroup():
                 return True
         return False
 
+    @metrics.timed("compute_clarities")
     def compute_clarities(self):
         cache_dir = self.check_cache()
         
         log("Computing clarities...")
+        results = dag.map(self.compute_clarity_track,
+                          range(len(self.raw_list)), self.jobs)
         self.clarity_list = []
         self.chroma_list = []
-        for i, raw in enumerate(tqdm(self.raw_list)):
+        for i, (clarity, chroma, notes) in enumerate(results):
+            # spilled clarities are mapped from their cache file
+            self.clarity_list.append( self.keep(clarity, self.cache_name(i, ".clarity"), np.float64, saved=True) )
+            if chroma is not None and self.memory_budget is None:
+                self.chroma_list.append(chroma)
+                self.note_list.append(notes)
+        if self.memory_budget is not None:
+            # the raw signals are done with after this (the chroma
+            # and notes are only for the plots)
+            self.release("raw_list")
+
+    # returns (clarity, chroma, notes), chroma and notes are None when
+    # the clarity came from the cache
+    def compute_clarity_track(self, i):
+        with metrics.stage("compute_clarities.track", track=self.name_list[i]):
             # check cache
+            raw = self.raw_list[i]
             fullname = os.path.join(self.path, self.name_list[i])
             name = os.path.basename(self.name_list[i])
             basename, ext = os.path.splitext(name)
@@ -231,58 +489,60 @@ class SampleGroup():
             if self.is_newer(cachename, fullname):
                 # load from cache
                 #print("loading from cache:", cachename)
+                metrics.cache(hit=True)
                 with open(cachename, "rb") as f:
                     clarity = np.load(f)
-            else:
-                # compute
-                chroma = librosa.feature.chroma_cqt(y=np.array(raw).astype('float'),
-                                                    sr=sample_rate,
-                                                    hop_length=hop_length)
-                self.chroma_list.append(chroma)
-                a = len(self.time_list[i])
-                b = len(self.intensity_list[i])
-                c = chroma.shape[1]
-                min = np.min([a, b, c])
-                notes = np.zeros(min)
-                clarity = np.zeros(min)
-                imax = np.max(self.intensity_list[i])
-                for j in range(min):
-                    notes[j] = np.argmax(chroma[:,j]) * (self.intensity_list[i][j] / imax)
-                    clarity[j] = (chroma[:,j] < 0.2).sum() * self.intensity_list[i][j]
-                self.note_list.append(notes.T)
-                clarity = clarity.T
-                # save in cache
-                #print("saving clarity as:", cachename)
-                with open(cachename, "wb") as f:
-                    np.save(f, clarity.T)
-            self.clarity_list.append(clarity)
-
-    def compute_rms(self):
-        # compute an rms metric for track, but just over the areas
-        # where clarity > threshold
-        log("Estimating rms for active regions:")
-        self.rms_list = []
-        for i in range(len(self.intensity_list)):
-            intensity = self.intensity_list[i]
-            # 3print("track:", i, len(clarity), len(intensity))
-            mean = np.mean(intensity)
-            std = np.std(intensity)
-            num = len(intensity)
-            five_perc = np.sort(intensity)[int(round(num*0.05))]
-            print("5%", five_perc)
-            #threshold = std * 0.1
-            threshold = 4 * five_perc
-            sum = 0
-            count = 0
-            for j in range(len(intensity)):
-                if intensity[j] >= threshold:
-                    sum += intensity[j]*intensity[j]
-                    count += 1
-            if count > 0:
-                self.rms_list.append( math.sqrt(sum / count) )
-            else:
-                self.rms_list.append( 0 )
-        log("rms:", self.rms_list)
+                return clarity, None, None
+            # compute
+            metrics.cache(hit=False)
+            import librosa
+            chroma = librosa.feature.chroma_cqt(y=np.array(raw).astype('float'),
+                                                sr=sample_rate,
+                                                hop_length=hop_length)
+            a = len(self.time_list[i])
+            b = len(self.intensity_list[i])
+            c = chroma.shape[1]
+            min = np.min([a, b, c])
+            notes = np.zeros(min)
+            clarity = np.zeros(min)
+            imax = np.max(self.intensity_list[i])
+            for j in range(min):
+                notes[j] = np.argmax(chroma[:,j]) * (self.intensity_list[i][j] / imax)
+                clarity[j] = (chroma[:,j] < 0.2).sum() * self.intensity_list[i][j]
+            clarity = clarity.T
+            # save in cache
+            #print("saving clarity as:", cachename)
+            with open(cachename, "wb") as f:
+                np.save(f, clarity.T)
+            return clarity, chroma, notes.T
+
+    # integrated (gated, K-weighted) loudness of each canonical track,
+    # used for balancing track gains in the mixer
+    @metrics.timed("compute_loudness")
+    def compute_loudness(self):
+        self.check_cache()
+
+        log("Measuring track loudness...")
+        self.loudness_list = dag.map(self.compute_loudness_track,
+                                     range(len(self.sample_list)), self.jobs)
+        log("loudness (LUFS):", ["%.1f" % l for l in self.loudness_list])
+
+    def compute_loudness_track(self, i):
+        with metrics.stage("compute_loudness.track", track=self.name_list[i]):
+            name = os.path.basename(self.name_list[i])
+            basename, ext = os.path.splitext(name)
+            cachename = os.path.join(self.path, "cache",
+                                     basename + ".loudness")
+            if self.is_newer(cachename, self.source_name(i)):
+                metrics.cache(hit=True)
+                with open(cachename, "rb") as f:
+                    return float(np.load(f)[0])
+            metrics.cache(hit=False)
+            y = sample_array(self.track_sample(i))
+            lufs = loudness.integrated(y, sample_rate)
+            with open(cachename, "wb") as f:
+                np.save(f, np.array([lufs]))
+            return lufs
         
     def compute_envelopes(self, hints={}):
         self.envelope_list = []
@@ -437,6 +697,7 @@ class SampleGroup():
         offsets -= np.median(offsets)
         return offsets                
  
+    @metrics.timed("correlate_mutual")
     def correlate_mutual(self, metric_list, plot=False):
         # compute relative time offsets by best correlation
         num = len(metric_list)
@@ -475,6 +736,7 @@ class SampleGroup():
                     offset_matrix[i, j] = shift_time
                     offset_matrix[j, i] = -shift_time
                 if plot:
+                    import matplotlib.pyplot as plt
                     plt.figure()
                     plt.plot(ycorr)
                     plt.figure()
@@ -511,6 +773,7 @@ class SampleGroup():
         result = np.amax(result) - result
         return result
     
+    @metrics.timed("correlate_to_reference")
     def correlate_to_reference(self, ref_index, metric_list, plot=False):
         # compute relative time offsets by best correlation
         num = len(metric_list)
@@ -546,6 +809,7 @@ class SampleGroup():
                 print(ref_index, 0)
             self.offset_list[i] = shift_time
             if plot:
+                import matplotlib.pyplot as plt
                 plt.figure()
                 plt.plot(ycorr)
                 plt.figure()
@@ -556,6 +820,7 @@ class SampleGroup():
         print("offset_list:\n", self.offset_list)
 
     # sync by claps
+    @metrics.timed("sync_by_claps")
     def sync_by_claps(self, plot=False):
         # presumes onset envelopes and clarities have been computed
 
@@ -602,12 +867,16 @@ class SampleGroup():
             
         self.correlate_mutual(lead_list, plot=plot)
 
+    @metrics.timed("clean_noise")
     def clean_noise(self, clean=0.2, reverb=0):
         cache_dir = self.check_cache()
         
-        for i, sample in enumerate(self.sample_list):
+        for i in range(len(self.sample_list)):
             fullname = os.path.join(self.path, self.name_list[i])
             name = os.path.basename(self.name_list[i])
+            if len(self.mix_list) and self.mix_list[i]:
+                log("Subgroup mix was cleaned in its own group, skipping:", name)
+                continue
             basename, ext = os.path.splitext(name)
             canon_name = os.path.join(self.path, "cache",
                                       basename + "-canon.mp3")
@@ -618,7 +887,9 @@ class SampleGroup():
             clean_name = os.path.join(self.path, "cache",
                                       basename + "-clean.mp3")
             log("Generating noise profile for:", name)
+            metrics.cache(hit=self.is_newer(clean_name, canon_name))
             if not self.is_newer(noise_name, canon_name):
+                sample = self.get_sample(i)
                 new_sample = AudioSegment.empty()
                 commands = self.suppress_list[i]
                 if len(commands):
@@ -672,10 +943,12 @@ class SampleGroup():
                     print(clean_name, "is newer than", noise_name)
             else:
                 log("No noise profile, using original sample as the cleaned version:", clean_name)
-                sample.export(clean_name, format="mp3")
+                self.get_sample(i).export(clean_name, format="mp3")
                 
     # visualize audio streams (using librosa functions)
     def gen_plots(self, sync_offsets=None):
+        import librosa.display
+        import matplotlib.pyplot as plt
         print("Generating basic clip waveform...")
         # plot basic clip waveforms
         fig, ax = plt.subplots(nrows=len(self.raw_list),
@@ -752,3 +1025,32 @@ class SampleGroup():
             ax[i].hlines(y=std, xmin=0, xmax=1)
        
         plt.show()
+
+# Save a subgroup mix losslessly into the parent group's cache and
+# precompute its analysis features there, so the parent group can pick
+# it up without decoding, filtering, or analyzing the mp3 again.
+# Call this after the group mp3 has been written (the cache freshness
+# checks compare against it.)  remix means the subgroup kept its
+# previous offsets (and so the mix its length and timing.)
+def save_lossless_mix(group_file, mixed, memory_budget=None, remix=False):
+    parent = SampleGroup(os.path.dirname(group_file))
+    parent.memory_budget = memory_budget
+    parent.check_cache()
+    name = os.path.basename(group_file)
+    lossless_name = parent.lossless_name(name)
+    log("Saving lossless subgroup mix:", lossless_name)
+    y = np.frombuffer(mixed.raw_data, dtype=np.int16)
+    y = y.reshape(-1, mixed.channels)
+    with open(lossless_name, "wb") as f:
+        np.save(f, y)
+    with open(parent.remix_name(name), "w") as fp:
+        json.dump( { "remix": remix }, fp )
+    parent.name_list = [ name ]
+    parent.mix_list = [ True ]
+    parent.sample_list = [ mixed ]
+    parent.duration_list = [ len(mixed) ]
+    parent.compute_raw()
+    parent.compute_onset()
+    parent.compute_intensities()
+    parent.compute_clarities()
+    parent.compute_loudness()
@@ -0,0 +1,110 @@
+# a small dependency graph (DAG) scheduler for pipeline stages.  A
+# stage starts as soon as all the stages it depends on are done, and
+# independent stages run concurrently in worker processes.
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import traceback
+
+from . import logger
+from .logger import log
+from . import metrics
+
+# runs a stage in a worker process and ships its metrics back
+def run_stage(name, func, args):
+    metrics.drain()             # forked copies of the parent's records
+    with metrics.stage(name):
+        result = func(*args)
+    return result, metrics.drain()
+
+def run_local(name, func, args):
+    with metrics.stage(name):
+        return func(*args)
+
+class Stage:
+    def __init__(self, name, func, args, deps):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.deps = deps
+        self.state = "waiting"  # waiting, running, done, failed, skipped
+        self.result = None
+
+class Graph:
+    def __init__(self):
+        self.stages = {}
+
+    # deps must already be in the graph, so insertion order is always a
+    # valid serial order
+    def add(self, name, func, args=(), deps=[]):
+        for dep in deps:
+            if not dep in self.stages:
+                raise ValueError("unknown dependency: " + dep)
+        self.stages[name] = Stage(name, func, args, list(deps))
+        return name
+
+    def ready(self):
+        result = []
+        for stage in self.stages.values():
+            if stage.state != "waiting":
+                continue
+            states = [ self.stages[dep].state for dep in stage.deps ]
+            if "failed" in states or "skipped" in states:
+                log("skipping stage (dependency failed):", stage.name)
+                stage.state = "skipped"
+            elif all(state == "done" for state in states):
+                result.append(stage)
+        return result
+
+    def finish(self, stage, func, *args):
+        try:
+            stage.result = func(*args)
+            stage.state = "done"
+        except BaseException as e:
+            # quit() inside a stage lands here too
+            log("stage failed:", stage.name, repr(e))
+            log(traceback.format_exc(), quiet=True)
+            stage.state = "failed"
+
+    # run the graph, returns True if every stage succeeded
+    def run(self, jobs=1):
+        if jobs <= 1:
+            # plain serial run in insertion order
+            for stage in self.stages.values():
+                if stage in self.ready():
+                    log("stage:", stage.name)
+                    stage.state = "running"
+                    self.finish(stage, run_local, stage.name, stage.func,
+                                stage.args)
+            return all(s.state == "done" for s in self.stages.values())
+
+        procs = ProcessPoolExecutor(max_workers=jobs,
+                                    initializer=logger.init,
+                                    initargs=(logger.logfile,))
+        running = {}
+        while True:
+            for stage in self.ready():
+                log("stage:", stage.name)
+                stage.state = "running"
+                future = procs.submit(run_stage, stage.name,
+                                      stage.func, stage.args)
+                running[future] = stage
+            if not len(running):
+                break
+            done, pending = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                self.finish(stage, future.result)
+                if stage.state == "done":
+                    stage.result, records = stage.result
+                    metrics.merge(records)
+                    log("stage done:", stage.name)
+        procs.shutdown()
+        return all(s.state == "done" for s in self.stages.values())
+
+# run func over each item on a pool of threads, results in item order
+def map(func, items, jobs=1):
+    items = list(items)
+    if jobs <= 1 or len(items) <= 1:
+        return [ func(item) for item in items ]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(func, items))
@@ -0,0 +1,160 @@
+# audio export stage: pipe pcm samples straight into ffmpeg encoders
+# (no temp wav files) from a bounded pool of worker threads.  The heavy
+# lifting happens in the ffmpeg processes, so threads are plenty.
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import os
+import subprocess
+import wave
+
+from .logger import log
+from . import metrics
+
+formats = [ "mp3", "flac", "opus", "wav" ]
+
+# ffmpeg encoder arguments per format
+encoders = {
+    "mp3": [ "-c:a", "libmp3lame", "-q:a", "2" ],
+    "flac": [ "-c:a", "flac" ],
+    "opus": [ "-c:a", "libopus", "-b:a", "160k" ],
+}
+
+# 48khz stereo int16, roughly a second of audio per block
+stems_block = 48000
+
+pool = None
+pool_pid = None
+pending = []
+failed = []                     # output files of failed encodes
+
+# start the worker pool (once per process, a forked copy of the
+# parent's pool has no threads behind it)
+def init(jobs=None):
+    global pool
+    global pool_pid
+    global failed
+    if pool is not None and pool_pid == os.getpid():
+        return
+    failed = []
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    log("export workers:", jobs)
+    pool = ThreadPoolExecutor(max_workers=jobs)
+    pool_pid = os.getpid()
+
+# file name with the extension for the requested format
+def filename(basename, format="mp3"):
+    return basename + "." + format
+
+def pcm_args(sample, channels=None):
+    if channels is None:
+        channels = sample.channels
+    return [ "-f", "s%dle" % (sample.sample_width * 8),
+             "-ar", str(sample.frame_rate),
+             "-ac", str(channels),
+             "-i", "pipe:0" ]
+
+def tag_args(tags):
+    args = []
+    for key in tags:
+        args += [ "-metadata", "%s=%s" % (key, tags[key]) ]
+    return args
+
+# encode one AudioSegment (blocking), failures are also reported by
+# wait()
+def export(sample, output_file, format="mp3", tags={}):
+    with metrics.stage("export", track=os.path.basename(output_file)):
+        result = export_sample(sample, output_file, format, tags)
+    if not result:
+        failed.append(output_file)
+    return result
+
+def export_sample(sample, output_file, format, tags):
+    if format == "wav":
+        # no encoder needed
+        with wave.open(output_file, "wb") as fp:
+            fp.setnchannels(sample.channels)
+            fp.setsampwidth(sample.sample_width)
+            fp.setframerate(sample.frame_rate)
+            fp.writeframes(sample.raw_data)
+        return True
+    command = [ "ffmpeg", "-y", "-loglevel", "error" ] + pcm_args(sample) \
+        + encoders[format] + tag_args(tags) + [ output_file ]
+    result = subprocess.run(command, input=sample.raw_data)
+    if result.returncode != 0:
+        log("export failed:", output_file, "ffmpeg result code:", result.returncode)
+        return False
+    return True
+
+# write all the (equal rate) samples into one multichannel wav file, two
+# channels per track in the order given, padded to the longest track.
+# Streamed through ffmpeg in blocks so rf64 kicks in for big projects
+# and we never hold the interleaved result in memory.  Samples may also
+# be (frames, 2) int16 arrays (memmaps of tracks spilled to the cache.)
+@metrics.timed("export_stems")
+def export_stems(output_file, names, samples, rate):
+    channels = 2 * len(samples)
+    arrays = []
+    for sample in samples:
+        if isinstance(sample, np.ndarray):
+            arrays.append(sample)
+            continue
+        sample = sample.set_channels(2)
+        y = np.frombuffer(sample.raw_data, dtype=np.int16).reshape(-1, 2)
+        arrays.append(y)
+    frames = max([len(y) for y in arrays])
+    command = [ "ffmpeg", "-y", "-loglevel", "error",
+                "-f", "s16le", "-ar", str(rate), "-ac", str(channels),
+                "-i", "pipe:0" ] \
+        + [ "-c:a", "pcm_s16le", "-rf64", "auto", output_file ]
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+    block = np.zeros((stems_block, channels), dtype=np.int16)
+    for start in range(0, frames, stems_block):
+        end = min(start + stems_block, frames)
+        block[:] = 0
+        for i, y in enumerate(arrays):
+            part = y[start:end]
+            block[:len(part), 2*i:2*i+2] = part
+        proc.stdin.write(block[:end-start].tobytes())
+    proc.stdin.close()
+    result = proc.wait()
+    if result != 0:
+        log("stems export failed, ffmpeg result code:", result)
+        failed.append(output_file)
+        return False
+    # channel map so the stems can be told apart
+    basename, ext = os.path.splitext(output_file)
+    with open(basename + ".txt", "w") as fp:
+        for i, name in enumerate(names):
+            fp.write("%d-%d %s\n" % (2*i + 1, 2*i + 2, name))
+    return True
+
+# queue up an export on the worker pool (or run it now if no pool)
+def submit(sample, output_file, format="mp3", tags={}):
+    if pool is None:
+        export(sample, output_file, format, tags)
+    else:
+        pending.append(pool.submit(export, sample, output_file, format, tags))
+
+def submit_stems(output_file, names, samples, rate):
+    if pool is None:
+        export_stems(output_file, names, samples, rate)
+    else:
+        pending.append(pool.submit(export_stems, output_file, names, samples, rate))
+
+# block until all queued exports have finished, raises if any export
+# (queued or not) failed since the last wait()
+def wait():
+    global pending
+    global failed
+    if len(pending):
+        log("Waiting for %d exports to finish..." % len(pending))
+    for job in pending:
+        job.result()
+    pending = []
+    if len(failed):
+        files = [ os.path.basename(f) for f in failed ]
+        failed = []
+        log("export failed:", files)
+        raise RuntimeError("%d audio exports failed" % len(files))
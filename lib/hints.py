@@ -1,8 +1,21 @@
 import csv
+import json
 import os
 
 from .logger import log
 
+# the pipeline steps each hint feeds, so an edit to hints.txt only
+# redoes those steps (unknown hints redo everything)
+stage_map = {
+    "gain": [ "mix" ],
+    "suppress": [ "mix" ],
+    "no_suppress": [ "clean", "mix" ],
+    "rotate": [ "faces", "render" ],
+    "video_shift": [ "render" ],
+    "video_hide": [ "render" ],
+    "face_detect": [ "render" ],
+}
+
 def load(path):
     hints_file = os.path.join(path, "hints.txt")
     hints = {}
@@ -59,3 +72,34 @@ def validate( hints, audio_tracks, video_tracks ):
         log("Name mismatches found in hints.txt file")
     else:
         log("All names in hints.txt file match up ok.")
+
+# the hints for just these tracks (json friendly, so they compare equal
+# to a saved copy)
+def subset(hints, tracks):
+    result = {}
+    for track in tracks:
+        name = os.path.basename(track)
+        if name in hints:
+            result[name] = hints[name]
+    return json.loads(json.dumps(result))
+
+# (name, hint) pairs that differ between two sets of hints
+def changes(old, new):
+    result = []
+    for name in sorted(set(old) | set(new)):
+        a = old.get(name, {})
+        b = new.get(name, {})
+        for hint in sorted(set(a) | set(b)):
+            if a.get(hint) != b.get(hint):
+                result.append( (name, hint) )
+    return result
+
+# the pipeline steps that need to be redone for these changes
+def stages(changes):
+    result = set()
+    for (name, hint) in changes:
+        if hint in stage_map:
+            result.update(stage_map[hint])
+        else:
+            result.add("all")
+    return result
@@ -3,9 +3,23 @@
 from datetime import datetime
 import os
 import socket                   # gethostname()
+import threading
 
 logfile = None
 logbuf = []
+# log() is called from worker threads (dag.map) too
+lock = threading.Lock()
+
+# a process forked while another thread was logging gets a fresh lock
+def reset_lock():
+    global lock
+    lock = threading.Lock()
+
+os.register_at_fork(after_in_child=reset_lock)
+
+# extra destinations for each log line, i.e. progress streamed back to
+# the job daemon from a worker process
+listeners = []
 
 def init( name ):
     global logfile
@@ -21,22 +35,25 @@ def log(*args, quiet=False, fancy=False):
     msg = []
     for a in args:
         msg.append(str(a))
-    if not fancy:
-        logbuf.append(timestamp + " ".join(msg))
-    else:
-        logbuf.append("")
-        logbuf.append("############################################################################")
-        logbuf.append("### " + timestamp + " ".join(msg))
-        logbuf.append("############################################################################")
-        logbuf.append("")
-    if logfile:
-        # flush log buffer
-        f = open(logfile, "a")
-        for line in logbuf:
-            f.write(line)
-            f.write("\n")
-        f.close()
-        logbuf = []
+    with lock:
+        for listener in listeners:
+            listener(timestamp + " ".join(msg))
+        if not fancy:
+            logbuf.append(timestamp + " ".join(msg))
+        else:
+            logbuf.append("")
+            logbuf.append("############################################################################")
+            logbuf.append("### " + timestamp + " ".join(msg))
+            logbuf.append("############################################################################")
+            logbuf.append("")
+        if logfile:
+            # flush log buffer
+            f = open(logfile, "a")
+            for line in logbuf:
+                f.write(line)
+                f.write("\n")
+            f.close()
+            logbuf = []
     if not quiet:
         print(*msg)
 
@@ -0,0 +1,79 @@
+# integrated loudness (ITU-R BS.1770-4 / EBU R128 style) measured with
+# vectorized block math: K-weighting filter, 400ms blocks with 75%
+# overlap, absolute gate at -70 LUFS and relative gate at -10 LU.
+
+import functools
+import math
+import numpy as np
+
+block_sec = 0.4
+overlap = 0.75
+absolute_gate = -70.0
+relative_gate = -10.0
+
+# reported for silent tracks (avoids -inf downstream)
+silence = -100.0
+
+# K-weighting: high shelf (head) followed by a high pass (rlb)
+# filter, coefficients derived for any sample rate with the bilinear
+# transform (matches the 48khz tables in the spec.)
+@functools.lru_cache(maxsize=None)
+def k_weighting(rate):
+    # stage 1, high shelf
+    G = 3.99984385397
+    Q = 0.7071752369554193
+    fc = 1681.9744509555319
+    K = math.tan(math.pi * fc / rate)
+    Vh = math.pow(10.0, G / 20.0)
+    Vb = math.pow(Vh, 0.499666774155)
+    a0 = 1.0 + K / Q + K * K
+    b1 = [ (Vh + Vb * K / Q + K * K) / a0,
+           2.0 * (K * K - Vh) / a0,
+           (Vh - Vb * K / Q + K * K) / a0 ]
+    a1 = [ 1.0, 2.0 * (K * K - 1.0) / a0, (1.0 - K / Q + K * K) / a0 ]
+    # stage 2, high pass
+    Q = 0.5003270373253953
+    fc = 38.13547087613982
+    K = math.tan(math.pi * fc / rate)
+    a0 = 1.0 + K / Q + K * K
+    b2 = [ 1.0, -2.0, 1.0 ]
+    a2 = [ 1.0, 2.0 * (K * K - 1.0) / a0, (1.0 - K / Q + K * K) / a0 ]
+    return np.vstack([ np.concatenate([b1, a1]), np.concatenate([b2, a2]) ])
+
+# integrated loudness (LUFS) of samples shaped (frames,) or
+# (frames, channels), full_scale is the sample value of 0 dBFS (default:
+# 32768 for 16 bit integers, 1.0 for floats)
+def integrated(y, rate, full_scale=None):
+    y = np.asarray(y)
+    if full_scale is None:
+        full_scale = 32768.0 if y.dtype == np.int16 else 1.0
+    if y.dtype == np.int16:
+        y = y.astype(np.float32)
+    if y.ndim == 1:
+        y = y.reshape(-1, 1)
+    block = int(round(block_sec * rate))
+    step = int(round(block * (1.0 - overlap)))
+    if y.shape[0] < block:
+        return silence
+    from scipy import signal   # slow import, only when needed
+    z = signal.sosfilt(k_weighting(rate), y, axis=0)
+    # mean square of every block from a running sum (all channels get
+    # unity weight, we only see mono/stereo here)
+    energy = np.concatenate([ [0.0], np.cumsum(np.sum(z * z, axis=1), dtype=np.float64) ])
+    starts = np.arange(0, y.shape[0] - block + 1, step)
+    power = (energy[starts + block] - energy[starts]) \
+        / (block * full_scale * full_scale)
+    with np.errstate(divide="ignore"):
+        lk = -0.691 + 10.0 * np.log10(power)
+    gated = power[lk > absolute_gate]
+    if not len(gated):
+        return silence
+    threshold = -0.691 + 10.0 * np.log10(np.mean(gated)) + relative_gate
+    gated = power[(lk > absolute_gate) & (lk > threshold)]
+    if not len(gated):
+        return silence
+    return -0.691 + 10.0 * math.log10(np.mean(gated))
+
+# linear gain that moves a track from one loudness to another
+def gain(lufs_from, lufs_to):
+    return math.pow(10.0, (lufs_to - lufs_from) / 20.0)
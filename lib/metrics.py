@@ -0,0 +1,187 @@
+# lightweight instrumentation: wall time, cpu time, peak memory, bytes
+# read, and cache hits/misses for each pipeline stage (and each track),
+# written as machine readable json next to the text report.
+#
+#   with metrics.stage("compute_raw", track=name):
+#       metrics.cache(hit=True)
+#
+#   @metrics.timed("mixer.combine")
+#   def combine(...):
+
+from contextlib import contextmanager
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+metrics_file = None
+records = []
+lock = threading.Lock()
+local = threading.local()
+
+def init(name):
+    global metrics_file
+    metrics_file = name
+
+# peak resident set size of this process (high water mark so far)
+def peak_rss_mb():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxrss / (1024 * 1024)  # bytes
+    return maxrss / 1024               # kilobytes
+
+# bytes read (files and pipes) by this process, or by the calling thread
+# only, 0 if unknown
+def bytes_read(thread=False):
+    if thread:
+        name = "/proc/thread-self/io"
+    else:
+        name = "/proc/self/io"
+    try:
+        with open(name, "r") as fp:
+            for line in fp:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+# cpu time used by finished child processes (ffmpeg, sox, ...)
+def children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def current():
+    if not hasattr(local, "stack"):
+        local.stack = []
+    return local.stack
+
+@contextmanager
+def stage(name, track=None):
+    record = { "stage": name, "pid": os.getpid(), "start": time.time(),
+               "cache_hits": 0, "cache_misses": 0 }
+    if track is not None:
+        record["track"] = track
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    process_cpu = time.process_time()
+    child_cpu = children_cpu()
+    read = bytes_read(thread=True)
+    process_read = bytes_read()
+    current().append(record)
+    try:
+        yield record
+    finally:
+        current().pop()
+        record["wall"] = time.perf_counter() - wall
+        # cpu is this thread, process_cpu includes helper threads (and
+        # anything else running in the process at the same time)
+        record["cpu"] = time.thread_time() - cpu
+        record["process_cpu"] = time.process_time() - process_cpu
+        record["children_cpu"] = children_cpu() - child_cpu
+        # bytes_read is this thread, process_bytes_read also counts the
+        # stages running in other threads (dag.map) at the same time
+        record["bytes_read"] = bytes_read(thread=True) - read
+        record["process_bytes_read"] = bytes_read() - process_read
+        # high water mark of the whole process so far, a reused worker
+        # process carries the peak of its earlier stages along
+        record["process_peak_rss_mb"] = peak_rss_mb()
+        with lock:
+            records.append(record)
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# attach extra information to the innermost stage of this thread
+def annotate(key, value):
+    stack = current()
+    if len(stack):
+        stack[-1][key] = value
+
+# accumulate the time spent in each phase of a loop (i.e. the per frame
+# steps of the video render):
+#   laps.start(); decode(); laps.lap("decode"); encode(); laps.lap("encode")
+class Laps:
+    def __init__(self):
+        self.totals = {}
+        self.last = None
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        if not phase in self.totals:
+            self.totals[phase] = 0.0
+        self.totals[phase] += now - self.last
+        self.last = now
+
+# count a cache hit or miss against the innermost stage of this thread
+def cache(hit):
+    stack = current()
+    if not len(stack):
+        return
+    if hit:
+        stack[-1]["cache_hits"] += 1
+    else:
+        stack[-1]["cache_misses"] += 1
+
+# hand over (and forget) the records collected so far, used to ship
+# records from worker processes back to the main process
+def drain():
+    global records
+    with lock:
+        result = records
+        records = []
+    return result
+
+def merge(more):
+    with lock:
+        records.extend(more)
+
+# what the process wide fields mean, written along with the summary
+notes = {
+    "process_peak_rss_mb": "process wide high water mark when the stage "
+                           "ended, includes earlier stages run by the same "
+                           "(reused) worker process",
+    "process_bytes_read": "process wide, includes reads of stages running "
+                          "in other threads at the same time (not summed)",
+}
+
+# per stage totals for a quick overview (bytes_read is per thread so it
+# adds up, process_peak_rss_mb is the largest process wide peak seen)
+def summary():
+    result = {}
+    for r in records:
+        if not r["stage"] in result:
+            result[r["stage"]] = { "count": 0, "wall": 0.0, "cpu": 0.0,
+                                   "children_cpu": 0.0, "bytes_read": 0,
+                                   "cache_hits": 0, "cache_misses": 0,
+                                   "process_peak_rss_mb": 0.0 }
+        s = result[r["stage"]]
+        s["count"] += 1
+        for key in [ "wall", "cpu", "children_cpu", "bytes_read",
+                     "cache_hits", "cache_misses" ]:
+            s[key] += r[key]
+        s["process_peak_rss_mb"] = max(s["process_peak_rss_mb"],
+                                       r["process_peak_rss_mb"])
+    return result
+
+def write():
+    if metrics_file is None:
+        return
+    with lock:
+        data = { "notes": notes,
+                 "summary": summary(),
+                 "records": sorted(records, key=lambda r: r["start"]) }
+    with open(metrics_file, "w") as fp:
+        json.dump(data, fp, indent=4)
@@ -1,20 +1,29 @@
-import math
 import numpy as np
 import os
 from pydub import AudioSegment, playback  # pip install pydub
 import random
 
+from . import analyze
+from . import export
+from . import loudness
+from . import resample
 from .logger import log
+from . import metrics
 
+# final mix level
+target_lufs = -16.0
+peak_limit = 31000              # leave headroom for reverb
+
+@metrics.timed("mixer.combine")
 def combine(group, sync_offsets, mute_tracks,
             hints={}, pan_range=0, suppress_silent_zones=False):
     durations_ms = []
-    for i, sample in enumerate(group.sample_list):
+    for i in range(len(group.sample_list)):
         name = os.path.basename(group.name_list[i])
         offset = sync_offsets[name]["offset"]
         print(name, offset)
-        # print(group.name_list[i], len(sample) / 1000, sync_offsets[i])
-        durations_ms.append( len(sample) + offset )
+        # print(group.name_list[i], group.duration_list[i] / 1000, sync_offsets[i])
+        durations_ms.append( group.duration_list[i] + offset )
     duration_ms = np.median(durations_ms)
     log("median audio duration (sec):", duration_ms / 1000)
 
@@ -40,8 +49,16 @@ def combine(group, sync_offsets, mute_tracks,
         elif "reference" in name.lower():
             mute_tracks.append(name)
 
-    rms_mean = np.mean(group.rms_list)
-    log("RMS mean: %.0f" % rms_mean)
+    # everything gets mixed at the project sample rate
+    sr = analyze.sample_rate
+    # balance tracks to their mean integrated loudness (silent tracks
+    # don't count)
+    active = [l for l in group.loudness_list if l > loudness.silence]
+    if len(active):
+        loudness_mean = np.mean(active)
+    else:
+        loudness_mean = loudness.silence
+    log("Loudness mean: %.1f LUFS" % loudness_mean)
     
     y_mixed = None
     mixed_count = 0
@@ -52,7 +69,11 @@ def combine(group, sync_offsets, mute_tracks,
         canon_name = os.path.join("cache", basefile + "-canon.mp3")
         clean_name = os.path.join("cache", basefile + "-clean.mp3")
         print("names:", canon_name, clean_name)
-        sample = group.load(clean_name)
+        if len(group.mix_list) and group.mix_list[i]:
+            # lossless subgroup mix, use as is
+            sample = group.get_sample(i)
+        else:
+            sample = group.load(clean_name)
         if sample is None:
             sample = group.load(canon_name)
         if sample is None:
@@ -68,17 +89,19 @@ def combine(group, sync_offsets, mute_tracks,
             track_gain = hints[name]["gain"]
         else:
             track_gain = 1.0
-        if group.rms_list[i] > 0:
-            rms_gain = rms_mean / group.rms_list[i]
+        if group.loudness_list[i] > loudness.silence:
+            level_gain = loudness.gain(group.loudness_list[i], loudness_mean)
         else:
-            rms_gain = 1
-        total_gain = track_gain * rms_gain
-        log("RMS: %.0f gain: %.3f" % (group.rms_list[i], rms_mean/group.rms_list[i]) )
+            level_gain = 1
+        total_gain = track_gain * level_gain
+        log("loudness: %.1f LUFS gain: %.3f" % (group.loudness_list[i], level_gain) )
         
         mixed_count += total_gain
         log(" ", group.name_list[i], "offset(sec): %.3f" % offset,
             "user gain: %.1f" % track_gain, "total gain: %.2f" % total_gain)
         sample = sample.set_channels(2)
+        if sample.frame_rate != sr:
+            sample = resample.resample_segment(sample, sr)
         if pan_range > 0.00001 and pan_range <= 1.0:
             sample = sample.pan( random.uniform(-pan_range, pan_range) )
         commands = []
@@ -124,7 +147,6 @@ def combine(group, sync_offsets, mute_tracks,
                 # renormalized in case we suppressed something crazy
                 # sample = sample.normalize()
                 # don't do this because we are using rms to do scaling now
-        sr = sample.frame_rate
         sync_ms = int(round(offset * 1000))
         if sync_ms < 0:
             synced_sample = sample[-sync_ms:]
@@ -134,7 +156,7 @@ def combine(group, sync_offsets, mute_tracks,
         # trim end for length
         synced_sample = synced_sample[:duration_ms]
         synced_sample = synced_sample.fade_out(1000)
-        group.sample_list[i] = synced_sample
+        group.set_sample(i, synced_sample, "-synced.npy")
 
         y = np.array(synced_sample.get_array_of_samples()).astype('double')
         print(i, "max:", np.max(np.abs(y)))
@@ -158,15 +180,17 @@ def combine(group, sync_offsets, mute_tracks,
         return AudioSegment.silent(1000)
     print("total max:", np.max(y_mixed))
     print("total min:", np.min(y_mixed))
-    min_div = np.max(np.abs(y_mixed)) / 31000 # leave headroom for reverb
-    print("min_div:", min_div, "sqrt(%.2f):" % mixed_count, math.sqrt(mixed_count))
-    if math.sqrt(mixed_count) > min_div:
-        # balsy but good chance of working
-        y_mixed /= math.sqrt(mixed_count)
-    else:
-        y_mixed /= min_div
-    #y_mixed /= math.pow(mixed_count, 0.6) # slightly more conservative
-    #y_mixed / len(mixed_count) # very conservative output levels
+    # normalize the mix to the target loudness, but never past the
+    # peak limit (leave headroom for reverb), the mix is still in 16
+    # bit units
+    mix_lufs = loudness.integrated(y_mixed.reshape(-1, 2), sr,
+                                   full_scale=32768.0)
+    peak = np.max(np.abs(y_mixed))
+    mix_gain = loudness.gain(mix_lufs, target_lufs)
+    if peak * mix_gain > peak_limit:
+        mix_gain = peak_limit / peak
+    log("mix loudness: %.1f LUFS, normalizing gain: %.3f" % (mix_lufs, mix_gain))
+    y_mixed *= mix_gain
     print("mixed max:", np.max(np.abs(y_mixed)))
     y_mixed = np.int16(y_mixed)
     mixed = AudioSegment(y_mixed.tobytes(), frame_rate=sr, sample_width=2, channels=sample.channels)
@@ -185,7 +209,7 @@ def clear_aligned(results_dir):
 # presumes the mixer has updated each sample with align/trim/pad and
 # noise suppression if requested, so this function just writes those
 # out without further modification.
-def save_aligned(results_dir, names, samples, mute_tracks,):
+def save_aligned(results_dir, names, samples, mute_tracks, format="mp3"):
     log("Writing aligned version of samples (padded/trimed)...", fancy=True)
     for i, sample in enumerate(samples):
         if names[i] in mute_tracks:
@@ -195,7 +219,28 @@ def save_aligned(results_dir, names, samples, mute_tracks,):
         name, ext = os.path.splitext(basename)
         # FilemailCli can't handle "," in file names
         name = name.replace(',', '')
-        output_file = os.path.join(results_dir, "aligned_audio_" + name + ".mp3")
-        log(" ", "aligned_audio_" + name + ".mp3")
-        sample.export(output_file, format="mp3")
-    
+        output_file = export.filename(os.path.join(results_dir, "aligned_audio_" + name), format)
+        log(" ", os.path.basename(output_file))
+        if isinstance(sample, np.ndarray):
+            # spilled to the cache (memory budget), don't queue up
+            # decoded copies of these
+            export.export(analyze.segment(sample), output_file, format)
+        else:
+            export.submit(sample, output_file, format)
+
+# all the aligned samples of a group in one multichannel file
+def save_stems(results_dir, group_name, names, samples, mute_tracks):
+    stem_names = []
+    stem_samples = []
+    for i, sample in enumerate(samples):
+        if names[i] in mute_tracks:
+            continue
+        stem_names.append(names[i])
+        stem_samples.append(sample)
+    if not len(stem_samples):
+        return
+    group_name = group_name.replace(',', '')
+    output_file = os.path.join(results_dir, "stems_" + group_name + ".wav")
+    log("Writing multichannel stems file:", os.path.basename(output_file))
+    export.submit_stems(output_file, stem_names, stem_samples,
+                        analyze.sample_rate)
@@ -0,0 +1,466 @@
+# the full sync/mix/render pipeline for a project, expressed as a graph
+# of stages: every work directory is a mix stage that depends on the
+# mix stages of its sub groups, face detection depends on nothing, and
+# the video stages wait for the mixes (offsets) and faces.
+
+import argparse
+import os
+from pydub import AudioSegment  # pip install pydub
+from subprocess import call
+
+from . import analyze
+from . import dag
+from . import export
+from . import hints
+from . import logger
+from .logger import log
+from . import metrics
+from . import mixer
+from . import scan
+from . import sync
+from . import video_writer
+
+tags = {'artist': 'Various', 'album': 'Virtual Choir Maker',
+        'comments': 'https://virtualchoir.flightgear.org'}
+
+def make_parser():
+    parser = argparse.ArgumentParser(description='virtual choir')
+    parser.add_argument('project', help='project folder')
+    parser.add_argument('--sync', default='clarity', choices=['clarity', 'clap'],
+                        help='sync strategy')
+    parser.add_argument('--reference', help='file name of declared refrence track')
+    parser.add_argument('--suppress-noise', action='store_true', help='try to suppress extraneous noises.')
+    parser.add_argument('--compression', action='store_true', help='dynamic range compression on final audio mix.')
+    parser.add_argument('--reverb', default='light', choices=['none', 'light', 'medium', 'heavy'],
+                        help='how much reverb in the final mix?')
+    parser.add_argument('--write-aligned-tracks', action='store_true', help='write out padded/clipped individual tracks aligned from start.')
+    parser.add_argument('--write-stems', action='store_true', help='write all aligned tracks of each group into one multichannel wav file.')
+    parser.add_argument('--audio-format', default='mp3', choices=export.formats,
+                        help='file format for aligned tracks and the final mix (full-mix.mp3 is always written.)')
+    parser.add_argument('--export-jobs', type=int, help='number of parallel audio encoders (default: number of cpus)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='number of cpus to use, split between pipeline stages running side by side and the per track work inside each stage, 1 runs everything in order')
+    parser.add_argument('--memory-budget', type=float,
+                        help='MB of per track audio data held in memory (shared by the groups mixing in parallel), the rest is spilled to compact memory mapped files in the cache (default: no limit)')
+    parser.add_argument('--mute-videos', action='store_true', help='mute all video tracks (some projects do all lip sync videos.')
+    parser.add_argument('--no-video', action='store_true', help='skip the video production.')
+    parser.add_argument('--preview', action='store_true', help='write a low res preview image of the video render and face detection about once a second (results/preview-*.jpg)')
+    parser.add_argument('--resolution', default='1080p',
+                        choices=['480p', '720p', '1080p', '1440p'],
+                        help='video output resolution')
+    parser.add_argument('--render-jobs', type=int, default=1,
+                        help='number of processes rendering the video in chunks (joined without encoding again), 1 renders in one process')
+    parser.add_argument('--x264-preset', default=video_writer.preset, choices=video_writer.presets,
+                        help='x264 preset for the video encode (slower compresses better)')
+    parser.add_argument('--x264-crf', type=int, default=video_writer.crf,
+                        help='x264 constant rate factor for the video encode (lower is better quality, 17 is visually lossless or nearly so)')
+    parser.add_argument('--x264-threads', type=int, help='x264 threads per video encoder (default: ffmpeg decides)')
+    parser.add_argument('--x264-tune', choices=video_writer.tunes, help='x264 tune for the video encode')
+    parser.add_argument('--rows', type=int, help='request specific number of video rows')
+    parser.add_argument('--crop', default='face', choices=['face', 'face-wide', 'fit', 'none'],
+                        help='video scaling/cropping strategy')
+    parser.add_argument('--pad-bottom', type=int, default=0, help='pad bottom with empty pixels to leave room for something to be added in later.')
+    return parser
+
+# structured options for run() without going through a command line,
+# starts from the command line defaults, i.e.:
+#   args = pipeline.options("project", sync="clap", no_video=True)
+def options(project, **kwargs):
+    args = make_parser().parse_args([project])
+    for key in kwargs:
+        if not hasattr(args, key):
+            raise ValueError("unknown pipeline option: " + key)
+        setattr(args, key, kwargs[key])
+    return args
+
+# sync and mix one work directory (sub groups must be done already),
+# track_jobs and memory_budget (bytes) are this group's share of --jobs
+# and --memory-budget (see run())
+def mix_group(args, dir, top, hint_dict, track_jobs=1, memory_budget=None):
+    results_dir = os.path.join(args.project, "results")
+    if top:
+        # last dir (top level)
+        group_file = os.path.join(results_dir, "full-mix.mp3")
+        clean = 0.1
+        suppress_silent_zones = True
+    else:
+        group_file = os.path.join(dir + "-mix.mp3")
+        clean = 0.25
+        suppress_silent_zones = True
+    #print("group_file:", group_file)
+    audio_group = analyze.SampleGroup(dir)
+    audio_group.jobs = track_jobs
+    audio_group.memory_budget = memory_budget
+    # what the sub group stages left behind
+    index = scan.ProjectIndex(dir)
+    audio_group.scan(index)
+    lof_file = os.path.join(dir, os.path.basename(dir) + "_audacity_import.lof")
+
+    # hints.txt edits only redo the steps the changed hints feed (when
+    # we know which hints the last run used)
+    group_hints = hints.subset(hint_dict, audio_group.name_list)
+    state = audio_group.read_state()
+    if state is None:
+        ignore = [ "cache" ]
+        changes = []
+    else:
+        ignore = [ "cache", "hints.txt" ]
+        changes = hints.changes(state["hints"], group_hints)
+    redo = hints.stages(changes)
+    newer = scan.newer_files(dir, group_file, ignore=ignore, index=index)
+    # a subgroup that was only remixed (its mix file, and maybe its
+    # hints.txt in its directory, are newer) keeps its timing, so this
+    # group only needs a remix too
+    remixed = []
+    if newer is not None and state is not None:
+        remixed = [ f for f in newer if f.endswith("-mix.mp3")
+                    and audio_group.is_remixed(f) ]
+        subgroups = [ f[:-len("-mix.mp3")] for f in remixed ]
+        newer = [ f for f in newer if not f in remixed
+                  and not f in subgroups ]
+    if newer is None or len(newer):
+        remix = False
+    elif "all" in redo:
+        log("hints changed:", changes)
+        remix = False
+    elif "mix" in redo or len(remixed):
+        if len(remixed):
+            log("remixed subgroups:", remixed)
+        if len(changes):
+            log("hints changed:", changes)
+        remix = audio_group.sync_file is not None or os.path.exists(lof_file)
+    else:
+        # nothing changed (for the audio), so skip processing
+        return
+
+    # audio encodes run in the background while we keep working
+    export.init(args.export_jobs)
+
+    if remix and ("clean" in redo or not audio_group.load_state(state)):
+        log("Hints changed, remixing with the previous offsets", fancy=True)
+        for (name, hint) in changes:
+            if hint == "no_suppress":
+                # noise profiles come from the suppressed regions
+                basename, ext = os.path.splitext(name)
+                for suffix in [ "-noise.mp3", ".noiseprof", "-clean.mp3" ]:
+                    cache_file = os.path.join(dir, "cache", basename + suffix)
+                    if os.path.exists(cache_file):
+                        os.unlink(cache_file)
+        audio_group.load_samples()
+    elif remix:
+        log("Only mix hints changed, remixing with the previous analysis and offsets", fancy=True)
+    else:
+        # load audio tracks, normalize, and resample at common (highest) sample rate
+        audio_group.load_samples()
+    if not len(audio_group.sample_list):
+        # nothing to do here
+        log("No audio/video tracks in this group:", dir)
+        return
+    # generate mono version, set consistent sample rate, and filer for
+    # analysis step (a remix only needs the envelopes and loudness,
+    # all from the cache)
+    audio_group.compute_raw()
+    if remix:
+        audio_group.compute_times()
+    else:
+        audio_group.compute_onset()
+    audio_group.compute_intensities()
+    if not remix:
+        audio_group.compute_clarities()
+    audio_group.compute_envelopes(hints=hint_dict)
+    audio_group.compute_loudness()
+    if not remix or "clean" in redo:
+        audio_group.clean_noise(clean=clean)
+
+    print("sync:", audio_group.sync_file)
+
+    sync_offsets = []
+    if remix and not audio_group.sync_file:
+        log("Using the previous time syncs:", lof_file)
+        sync_offsets = sync.parse_lof(lof_file, 0.0, "")
+    elif not audio_group.sync_file:
+        # let's figure out the autosync, fingers crossed!!!
+        log("Starting automatic track alignment process...", fancy=True)
+
+        log("Correlating audio samples")
+        if args.reference:
+            ref_index = -1
+            for i, name in enumerate(audio_group.name_list):
+                if name.endswith(args.reference):
+                    ref_index = i
+                    print("found reference track, index:", i)
+            if ref_index < 0:
+                print("Unable to match reference track name, giving up.")
+                quit()
+            audio_group.correlate_to_reference(ref_index, audio_group.clarity_list, plot=True)
+            #audio_group.correlate_to_reference(ref_index, audio_group.note_list, plot=True)
+        elif args.sync == "clarity":
+            log("Sync by mutual best fit")
+            audio_group.correlate_mutual(audio_group.clarity_list, plot=False)
+        elif args.sync == "clap":
+            log("Sync by lead in claps")
+            audio_group.sync_by_claps(plot=False)
+
+        log("Generating audacity_import.lof file")
+        with open(lof_file, 'w') as fp:
+            for i in range(len(audio_group.offset_list)):
+                fp.write('file "%s" offset %.3f\n' % (audio_group.name_list[i], audio_group.offset_list[i]))
+        sync_offsets = {}
+        for i in range(len(audio_group.offset_list)):
+            name = os.path.basename( audio_group.name_list[i] )
+            offset = audio_group.offset_list[i]
+            sync_offsets[name] = { "offset": offset }
+    else:
+        # we found an audacity project, let's read the sync offsets from that
+        log("Found an sync file, using that for time syncs:",
+            audio_group.sync_file, fancy=True)
+        sync_offsets = sync.parse_json(os.path.join(dir, audio_group.sync_file),
+                                       0.0, "",
+                                       audio_group.name_list)
+
+    if False:
+        audio_group.gen_plots(sync_offsets=None)
+
+    log("Mixing samples...", fancy=True)
+
+    if args.mute_videos:
+        log("Reqeust to mute the audio channels on videos: lip sync mode.")
+        mute_tracks = audio_group.video_list
+    else:
+        mute_tracks = []
+    mixed = mixer.combine(audio_group, sync_offsets,
+                          mute_tracks, hints=hint_dict, pan_range=0.1,
+                          suppress_silent_zones=suppress_silent_zones)
+    log("Mixed audio file:", group_file)
+    if audio_group.memory_budget is not None:
+        # only the aligned samples are needed from here on
+        audio_group.release("intensity_list")
+        audio_group.release("clarity_list")
+
+    if top:
+        # the mixer already normalized the mix loudness
+        if args.compression:
+            print("before compress max:", mixed.max)
+            log("Applying compression (may take some time) ...")
+            mixed = mixed.compress_dynamic_range()
+            # compression has no makeup gain, bring the level back up
+            mixed = mixed.normalize()
+            print("after compress max:", mixed.max)
+
+        # top level final mix, write a temp file, then add reverb with sox
+        reverb = 0
+        if args.reverb == "light":
+            reverb = 25
+        elif args.reverb == "medium":
+            reverb = 50
+        elif args.reverb == "heavy":
+            reverb = 75
+        if reverb > 0:
+            # reverb the lossless mix, encode the result afterwards
+            tmp_file = group_file + "-tmp.wav"
+            rev_file = group_file + "-reverb.wav"
+            export.export(mixed, tmp_file, format="wav")
+            command = [ "sox", tmp_file, rev_file,
+                        "reverb", "%d" % reverb, "50", "75" ]
+            log("command:", command)
+            try:
+                result = call(command)
+            except OSError as e:
+                # no sox
+                log("cannot run sox:", e)
+                result = -1
+            log("sox result code:", result)
+            if result == 0:
+                mixed = AudioSegment.from_file(rev_file, "wav")
+            else:
+                log("NOTICE: reverb failed, writing the mix without it.")
+            os.unlink(tmp_file)
+            if os.path.exists(rev_file):
+                os.unlink(rev_file)
+        export.submit(mixed, group_file, format="mp3", tags=tags)
+        if args.audio_format != "mp3":
+            base, ext = os.path.splitext(group_file)
+            export.submit(mixed, export.filename(base, args.audio_format),
+                          format=args.audio_format, tags=tags)
+    else:
+        # sub group mix (needed right away by the parent group)
+        export.export(mixed, group_file, format="mp3", tags=tags)
+        # hand the mix up to the parent group without an mp3 generation
+        # (its features are computed while this group still holds its
+        # arrays, so with what's left of the budget)
+        analyze.save_lossless_mix(group_file, mixed,
+                                  memory_budget=audio_group.budget_left(),
+                                  remix=remix)
+
+    if args.write_aligned_tracks:
+        log("Generating trimmed/padded tracks that start at a common aligned time.")
+        # write trimmed/padded samples for 'easy' alignment
+        mixer.save_aligned(results_dir, audio_group.name_list,
+                           audio_group.sample_list, mute_tracks,
+                           format=args.audio_format)
+    if args.write_stems:
+        mixer.save_stems(results_dir, os.path.basename(dir),
+                         audio_group.name_list, audio_group.sample_list,
+                         mute_tracks)
+
+    # make sure all the audio has landed before the stage is done
+    export.wait()
+    audio_group.save_state(group_hints)
+    if audio_group.memory_budget is not None:
+        log("memory high water mark: %.0f MB, spilled to cache: %.0f MB" %
+            (metrics.peak_rss_mb(), audio_group.memory_spilled / (1024*1024)))
+        metrics.annotate("spilled_mb", audio_group.memory_spilled / (1024*1024))
+
+# the video modules (opencv, sk-video, dlib) are only imported by the
+# video stages so audio only runs start quickly
+
+# face detection only needs the video files
+def find_faces(args, video_tracks, hint_dict):
+    from . import preview
+    from . import video_faces
+    if args.preview:
+        preview.init(os.path.join(args.project, "results"))
+    video_faces.find_faces(args.project, video_tracks, hint_dict)
+    preview.close()
+
+# per video sync offsets (from all the group .lof/.json files)
+def video_offsets(args, video_tracks):
+    offsets = sync.build_offset_map(args.project)
+    result = []
+    for track in video_tracks:
+        trackbase, ext = os.path.splitext(track)
+        if track in offsets:
+            # from .lof file
+            offset = offsets[track]["offset"]
+        elif trackbase in offsets:
+            # audactiy info macro doesn't include ext
+            offset = offsets[trackbase]["offset"]
+        else:
+            log("No offset found for:", track)
+        print(track, offset)
+        result.append(offset)
+    return result
+
+def save_aligned_videos(args, video_tracks):
+    from . import video
+    results_dir = os.path.join(args.project, "results")
+    log("Generating trimmed/padded tracks that start at a common aligned time.")
+    video.save_aligned(args.project, results_dir, video_tracks,
+                       video_offsets(args, video_tracks))
+
+def render_video(args, video_tracks, hint_dict, title_page, credits_page):
+    from . import preview
+    from . import video
+    results_dir = os.path.join(args.project, "results")
+    if args.preview:
+        preview.init(results_dir)
+    log("Generating gridded video", fancy=True)
+    offsets = video_offsets(args, video_tracks)
+    # render the new combined video
+    video.render_combined_video( args.project, args.resolution, results_dir,
+                                 video_tracks, offsets,
+                                 hints=hint_dict, rows=args.rows,
+                                 crop=args.crop,
+                                 title_page=title_page,
+                                 credits_page=credits_page,
+                                 pad_bottom=args.pad_bottom,
+                                 jobs=args.render_jobs,
+                                 audio_file=os.path.join(results_dir, "full-mix.mp3"),
+                                 encoder={ "preset": args.x264_preset,
+                                           "crf": args.x264_crf,
+                                           "threads": args.x264_threads,
+                                           "tune": args.x264_tune })
+    preview.close()
+
+# run the whole job, returns True on success.  Safe to call repeatedly
+# from a long running (worker) process.
+def run(args):
+    # hold the log lines until this project's report file is known, and
+    # forget metrics from any previous job
+    logger.init(None)
+    metrics.drain()
+    log("Begin processing job", fancy=True)
+    log("Command line arguments:", args)
+
+    index = scan.ProjectIndex(args.project)
+    work_dirs = scan.work_directories(args.project, order="bottom_up",
+                                      index=index)
+    print("work dirs:", work_dirs)
+
+    all_audio_tracks, all_video_tracks = scan.recurse_directory(args.project, index=index)
+
+    title_page = scan.find_basename(args.project, "title", index)
+    if title_page:
+        log("title page:", title_page)
+    credits_page = scan.find_basename(args.project, "credits", index)
+    if credits_page:
+        log("credits page:", credits_page)
+    log("audio tracks:", all_audio_tracks)
+    log("video tracks:", all_video_tracks)
+
+    # load and accumulate hints for all dirs
+    hint_dict = {}
+    for dir in work_dirs:
+        hint_dict.update( hints.load(dir) )
+    log("hints:", hint_dict)
+    hints.validate( hint_dict, all_audio_tracks, all_video_tracks )
+
+    # make results directory (if it doesn't exist)
+    results_dir = os.path.join(args.project, "results")
+    if not os.path.exists(results_dir):
+        print("Creating:", results_dir)
+        os.makedirs(results_dir)
+
+    # initialize logger and the machine readable run report
+    logger.init( os.path.join(results_dir, "report.txt") )
+    metrics.init( os.path.join(results_dir, "metrics.json") )
+
+    if False and args.write_aligned_tracks:
+        mixer.clear_aligned(results_dir)
+
+    # build the stage graph, bottom up work dirs means sub groups are
+    # always added before their parent
+    graph = dag.Graph()
+    # --jobs is split between the stages that can run at the same time
+    # (no more than one mix per leaf group, plus face detection) and
+    # the per track work inside each mix, so no more than jobs tracks
+    # are worked on at once.  The memory budget is split between the
+    # mixes the same way.
+    video = len(all_video_tracks) and not args.no_video
+    leaves = [ d for d in work_dirs
+               if not any(os.path.dirname(s) == d for s in work_dirs) ]
+    stage_jobs = max(min(args.jobs, len(leaves) + (1 if video else 0)), 1)
+    mix_jobs = max(min(stage_jobs, len(leaves)), 1)
+    track_jobs = max(args.jobs // stage_jobs, 1)
+    log("parallel stages:", stage_jobs, "threads per mix:", track_jobs)
+    memory_budget = None
+    if args.memory_budget is not None:
+        memory_budget = int(args.memory_budget * 1024 * 1024 / mix_jobs)
+        log("memory budget per group: %.0f MB" % (memory_budget / (1024*1024)))
+    mix_stages = []
+    for dir in work_dirs:
+        top = (dir == work_dirs[-1])
+        deps = [ "mix:" + d for d in work_dirs if os.path.dirname(d) == dir ]
+        mix_stages.append( graph.add("mix:" + dir, mix_group,
+                                     (args, dir, top, hint_dict,
+                                      track_jobs, memory_budget), deps) )
+    if video:
+        faces = graph.add("faces", find_faces,
+                          (args, all_video_tracks, hint_dict))
+        if args.write_aligned_tracks:
+            graph.add("aligned-videos", save_aligned_videos,
+                      (args, all_video_tracks), mix_stages)
+        graph.add("render", render_video,
+                  (args, all_video_tracks, hint_dict, title_page,
+                   credits_page), mix_stages + [faces])
+    else:
+        log("No video tracks, or audio-only requested.")
+
+    result = graph.run(stage_jobs)
+    metrics.write()
+    log("Stage metrics:", metrics.metrics_file)
+    if result:
+        log("End of processing.", fancy=True)
+    else:
+        log("Processing failed.", fancy=True)
+    return result
@@ -0,0 +1,91 @@
+# optional low res previews (render output, face detection) for
+# watching a job on a headless server: the latest frame is handed to a
+# side thread that writes it as a jpeg at most once per interval, so
+# the render loop never waits on a gui or the disk.  Off unless init()
+# is called.
+
+import cv2
+import os
+import threading
+import time
+
+from .logger import log
+
+interval = 1.0                  # sec between preview images
+width = 480                     # preview image width
+
+preview_dir = None
+previews = {}                   # name -> Preview
+
+class Preview():
+    def __init__(self, path):
+        self.path = path
+        self.frame = None
+        self.last = 0
+        self.done = False
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.writer, daemon=True)
+        self.thread.start()
+
+    def show(self, frame):
+        now = time.time()
+        if now - self.last < interval:
+            return
+        self.last = now
+        # the caller may reuse its buffer
+        with self.lock:
+            self.frame = frame.copy()
+        self.ready.set()
+
+    def writer(self):
+        while True:
+            self.ready.wait()
+            self.ready.clear()
+            with self.lock:
+                frame = self.frame
+                self.frame = None
+            if frame is not None:
+                (h, w) = frame.shape[:2]
+                if w > width:
+                    frame = cv2.resize(frame, (width, int(round(h * width / w))),
+                                       interpolation=cv2.INTER_AREA)
+                # write then rename so viewers never see half a file
+                tmp_file = self.path + ".tmp.jpg"
+                cv2.imwrite(tmp_file, frame)
+                os.replace(tmp_file, self.path)
+            if self.done:
+                break
+
+    def close(self):
+        self.done = True
+        self.ready.set()
+        self.thread.join()
+
+# turn previews on, images go to dir/preview-<name>.jpg
+def init(dir):
+    global preview_dir
+    preview_dir = dir
+    log("writing previews to:", os.path.join(dir, "preview-*.jpg"))
+
+def show(name, frame):
+    if preview_dir is None or frame is None:
+        return
+    if not name in previews:
+        previews[name] = Preview(os.path.join(preview_dir, "preview-" + name + ".jpg"))
+    previews[name].show(frame)
+
+# write out the last frames, stop the writer threads and turn
+# previews off again.  With a name only that preview is finished (the
+# others and previews stay on.)
+def close(name=None):
+    global preview_dir
+    global previews
+    if name is not None:
+        if name in previews:
+            previews.pop(name).close()
+        return
+    for name in previews:
+        previews[name].close()
+    previews = {}
+    preview_dir = None
@@ -0,0 +1,47 @@
+# polyphase sample rate conversion for numpy sample blocks (much
+# cleaner than audioop.ratecv that pydub's set_frame_rate() uses, and
+# faster too.)
+
+from fractions import Fraction
+import functools
+import numpy as np
+from pydub import AudioSegment
+
+# oddball phone rates (i.e. 44056) would otherwise produce huge up/down
+# factors, this keeps the ratio error in the parts per million range
+max_factor = 1000
+
+def ratio(rate_in, rate_out):
+    frac = Fraction(int(rate_out), int(rate_in)).limit_denominator(max_factor)
+    return frac.numerator, frac.denominator
+
+# anti-aliasing low pass filter, same kaiser window design that
+# resample_poly() would do on every call, but done once per rate pair
+@functools.lru_cache(maxsize=None)
+def design(up, down):
+    from scipy import signal   # slow import, only when needed
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    h = signal.firwin(2 * half_len + 1, 1.0 / max_rate,
+                      window=('kaiser', 5.0))
+    return h.astype(np.float32)
+
+# resample a block of samples, shape (frames,) or (frames, channels)
+def resample(y, rate_in, rate_out):
+    if rate_in == rate_out:
+        return y
+    from scipy import signal
+    up, down = ratio(rate_in, rate_out)
+    return signal.resample_poly(np.asarray(y, dtype=np.float32), up, down,
+                                axis=0, window=design(up, down))
+
+# resample a pydub AudioSegment (16 bit samples)
+def resample_segment(sample, rate_out):
+    if sample.frame_rate == rate_out:
+        return sample
+    y = np.frombuffer(sample.raw_data, dtype=np.int16)
+    y = y.reshape(-1, sample.channels)
+    y = resample(y, sample.frame_rate, rate_out)
+    y = np.clip(np.round(y), -32768, 32767).astype(np.int16)
+    return AudioSegment(y.tobytes(), frame_rate=rate_out, sample_width=2,
+                        channels=sample.channels)
@@ -9,19 +9,63 @@ sync_extension = "json"
 ignore_extensions = [ "au", "aup3", "lof", "txt", "zip" ]
 ignore_files = [ "full-mix", "gridded_video", "mixed_audio", "silent_video" ]
 
+# one os.scandir() pass per directory with the stat results kept, so
+# the helpers below don't list and stat the same (network mounted?)
+# directories over and over.  Directories are read the first time they
+# are asked for and never again, so an index only sees what existed by
+# then: make a new one per pipeline stage.
+class ProjectIndex():
+    def __init__(self, path):
+        self.path = path
+        self.dirs = {}
+
+    # name -> (is dir, mtime) of everything in a directory, sorted by
+    # name (empty if it doesn't exist)
+    def listing(self, path):
+        key = os.path.normpath(path)
+        if not key in self.dirs:
+            entries = []
+            try:
+                with os.scandir(key) as it:
+                    for entry in it:
+                        try:
+                            entries.append( (entry.name, (entry.is_dir(), entry.stat().st_mtime)) )
+                        except OSError:
+                            # vanished while we looked
+                            pass
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            self.dirs[key] = dict(sorted(entries))
+        return self.dirs[key]
+
+    def isdir(self, path):
+        dir, name = os.path.split(os.path.normpath(path))
+        entry = self.listing(dir or ".").get(name)
+        return entry is not None and entry[0]
+
+    # modification time (None if path doesn't exist)
+    def mtime(self, path):
+        dir, name = os.path.split(os.path.normpath(path))
+        entry = self.listing(dir or ".").get(name)
+        if entry is None:
+            return None
+        return entry[1]
+
 # scan a directory for the things (does recurse)
-def recurse_directory(path, pretty_path=""):
+def recurse_directory(path, pretty_path="", index=None):
+    if index is None:
+        index = ProjectIndex(path)
     audio_tracks = []
     video_tracks = []
-    for file in sorted(os.listdir(path)):
+    for file in index.listing(path):
         fullname = os.path.join(path, file)
         pretty_name = os.path.join(pretty_path, file)
         # print(pretty_name)
-        if os.path.isdir(fullname):
+        if index.isdir(fullname):
             if file == "cache" or file == "results":
                 pass
             else:
-                a, v = recurse_directory(fullname, pretty_name)
+                a, v = recurse_directory(fullname, pretty_name, index)
                 audio_tracks += a
                 video_tracks += v
         else:
@@ -42,13 +86,15 @@ def recurse_directory(path, pretty_path=""):
     return audio_tracks, video_tracks
 
 # scan a directory for the things (does not recurse)
-def scan_directory(path):
+def scan_directory(path, index=None):
+    if index is None:
+        index = ProjectIndex(path)
     audio_tracks = []
     video_tracks = []
     sync_file = None
-    for file in sorted(os.listdir(path)):
+    for file in index.listing(path):
         fullname = os.path.join(path, file)
-        if os.path.isdir(fullname):
+        if index.isdir(fullname):
             # skip subdirectories
             pass
         else:
@@ -69,32 +115,36 @@ def scan_directory(path):
     return audio_tracks, video_tracks, sync_file
 
 # scan for nested work directories
-def work_directories(path, order="bottom_up", pretty_path=""):
+def work_directories(path, order="bottom_up", pretty_path="", index=None):
+    if index is None:
+        index = ProjectIndex(path)
     dirs = []
     if path.endswith("/"):
         path = path[:-1]
     if order == "top_down":
         dirs.append(path)
-    for file in sorted(os.listdir(path)):
+    for file in index.listing(path):
         fullname = os.path.join(path, file)
         pretty_name = os.path.join(pretty_path, file)
         # print(pretty_name)
-        if os.path.isdir(fullname):
+        if index.isdir(fullname):
             if file == "cache" or file == "results":
                 pass
             elif file.endswith("_data"):
                 # assume this is an audacity project dir
                 log("Skipping audacity project dir:", pretty_name)
             else:
-                dirs += work_directories(fullname, order, pretty_name)
+                dirs += work_directories(fullname, order, pretty_name, index)
     if order == "bottom_up":
         dirs.append( path )
     return dirs
 
 # search path (does not recurse) for file with matching basename (case
 # insensitive)
-def find_basename(path, search):
-    for file in sorted(os.listdir(path)):
+def find_basename(path, search, index=None):
+    if index is None:
+        index = ProjectIndex(path)
+    for file in index.listing(path):
         basename, ext = os.path.splitext(file)
         if basename.lower() == search:
             # return pretty name for convenience
@@ -103,8 +153,10 @@ def find_basename(path, search):
 
 # search path (does not recurse) for file with matching basename (case
 # insensitive)
-def find_extension(path, search):
-    for file in sorted(os.listdir(path)):
+def find_extension(path, search, index=None):
+    if index is None:
+        index = ProjectIndex(path)
+    for file in index.listing(path):
         basename, ext = os.path.splitext(file)
         if ext[1:].lower() == search:
             # return pretty name for convenience
@@ -112,7 +164,11 @@ def find_extension(path, search):
     return None
 
 # return true if a is newer or same age than b, else false
-def is_newer(a, b):
+def is_newer(a, b, index=None):
+    if index is not None:
+        mtime_a = index.mtime(a)
+        mtime_b = index.mtime(b)
+        return mtime_a is not None and mtime_b is not None and mtime_a > mtime_b
     if os.path.exists(a) and os.path.exists(b):
         stat_a = os.stat(a)
         mtime_a = stat_a.st_mtime
@@ -122,18 +178,30 @@ def is_newer(a, b):
             return True
     return False
 
-# scan a directory for the things (does not recurse)
-def check_for_newer(path, ref_file):
-    if not os.path.exists(ref_file):
+# the files in a directory (does not recurse) newer than ref_file,
+# None if there is no ref_file (files named in ignore don't count)
+def newer_files(path, ref_file, ignore=[], index=None):
+    if index is None:
+        index = ProjectIndex(path)
+    if index.mtime(ref_file) is None:
         print("no ref file, need to process")
-        return True
-    for file in sorted(os.listdir(path)):
+        return None
+    result = []
+    for file in index.listing(path):
         fullname = os.path.join(path, file)
-        if os.path.isdir(fullname) and file == "results":
+        if index.isdir(fullname) and file == "results":
             # don't consider newer files in the results dir a reason
             # to flag a dependency is newer
             print("ignoring:", fullname)
-        elif is_newer(fullname, ref_file):
+        elif file in ignore:
+            print("ignoring:", fullname)
+        elif is_newer(fullname, ref_file, index):
             print(fullname, "is newer than", ref_file)
-            return True
-    return False
+            result.append(file)
+    return result
+
+# scan a directory for the things (does not recurse)
+# (files named in ignore don't count)
+def check_for_newer(path, ref_file, ignore=[], index=None):
+    newer = newer_files(path, ref_file, ignore, index)
+    return newer is None or len(newer) > 0
@@ -61,7 +61,9 @@ def parse_json(json_file, dir_offset, pretty_path, audio_tracks=None):
 
 def build_offset_map(path):
     offsets = {}
-    dirs = scan.work_directories(path, order="top_down")
+    # the mix stages have written their .lof files by now
+    index = scan.ProjectIndex(path)
+    dirs = scan.work_directories(path, order="top_down", index=index)
     remove = len(dirs[0])            # hacky
     for dir in dirs: 
         pretty_path = dir[(remove+1):]
@@ -80,8 +82,8 @@ def build_offset_map(path):
         else:
             dir_offset = 0.0
         print(dir, basename, dir_offset)
-        sync_file = scan.find_extension(dir, "json")
-        lof_file = scan.find_extension(dir, "lof")
+        sync_file = scan.find_extension(dir, "json", index)
+        lof_file = scan.find_extension(dir, "lof", index)
         if sync_file:
             result = parse_json(sync_file, dir_offset, pretty_path)
             offsets.update( result )
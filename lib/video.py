@@ -1,20 +1,46 @@
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 import json
 import math
 import numpy as np
 import os
 from pydub import AudioSegment
+import queue
 import skvideo.io               # pip install sk-video
 from subprocess import call
+import threading
 from tqdm import tqdm
 
+from . import logger
 from .logger import log
+from . import metrics
+from . import preview
 from . import video_crop
 from . import video_faces
+from . import video_plan
+from .video_compositor import Compositor
 from .video_track import VideoTrack
-from .video_grid import VideoGrid
+from .video_writer import VideoWriter
 from .video_spiral import VideoSpiral
 
+# frames in flight between the render stages
+render_queue = 4
+
+# background wings (behind frames that don't fill their cell) are
+# blurred at 1/wings_shrink size and redrawn every wings_refresh source
+# frames, or sooner when the mean difference of a sparse sample of the
+# frame from the last redraw is more than scene_change
+wings_shrink = 8
+wings_refresh = 8
+scene_change = 12
+
+# chunked renders: output time (sec) each chunk decodes ahead of its
+# first frame without drawing it (long enough for a track that ended
+# just before to fade to black, as it has by then in a single process
+# render), and the shortest chunk worth a process
+chunk_preroll = 2.0
+min_chunk_secs = 10
+
 def gen_dicts(fps, quality="sane"):
     inputdict = {
         '-r': str(fps)
@@ -41,11 +67,13 @@ def gen_dicts(fps, quality="sane"):
 
 # fixme: figure out why zooming on some landscape videos in some cases
 #        doesn't always fill the grid cell (see Coeur, individual grades.) 
+@metrics.timed("render_combined_video")
 def render_combined_video(project, resolution, results_dir,
                           video_names, offsets, hints={}, rows=None,
                           crop='face',
                           title_page=None, credits_page=None,
-                          pad_bottom=0, pad_top=0, pad_left=0, pad_right=0):
+                          pad_bottom=0, pad_top=0, pad_left=0, pad_right=0,
+                          jobs=1, audio_file=None, encoder={}):
     if resolution == '480p':
         output_w = 854
         output_h = 480
@@ -67,8 +95,64 @@ def render_combined_video(project, resolution, results_dir,
 
     # load/find face locations
     faces = video_faces.find_faces(project, video_names, hints)
-    
+
+    # everything a render (or a chunk of it in another process) needs
+    # to set itself up
+    job = { "project": project,
+            "output_w": output_w,
+            "output_h": output_h,
+            "output_fps": output_fps,
+            "video_names": video_names,
+            "offsets": offsets,
+            "hints": hints,
+            "faces": faces,
+            "rows": rows,
+            "crop": crop,
+            "title_page": title_page,
+            "credits_page": credits_page,
+            "pad_top": pad_top,
+            "pad_bottom": pad_bottom,
+            "pad_left": pad_left,
+            "pad_right": pad_right,
+            "encoder": encoder }
+    scene = setup_scene(job)
+    if scene is None:
+        return
+    # what every output frame shows, so every chunk agrees on it
+    plan = video_plan.make_plan(scene["videos"], job, scene["duration"])
+
+    # the audio goes into the same encode (or the join of the chunks)
+    if audio_file is not None and not os.path.exists(audio_file):
+        log("no audio mix found, the video will be silent:", audio_file)
+        audio_file = None
+    output_file = os.path.join(results_dir, "gridded_video.mp4")
+    frame_count = len(plan.times)
+    chunks = min(jobs, int(frame_count / (min_chunk_secs * output_fps)))
+    if chunks <= 1:
+        frames, totals = render_frames(scene, job, plan, 0, output_file,
+                                       audio_file=audio_file)
+    else:
+        frames, totals = render_chunks(job, plan, chunks, output_file,
+                                       audio_file)
+    log("gridded video file: gridded_video.mp4")
+    log("render phases (sec):",
+        ", ".join([ "%s: %.1f" % (p, totals[p]) for p in totals ]))
+    metrics.annotate("frames", frames)
+    metrics.annotate("phases", totals)
+
+# static pages and probed videos for a render
+def setup_scene(job):
+    output_w = job["output_w"]
+    output_h = job["output_h"]
+    project = job["project"]
+    title_page = job["title_page"]
+    credits_page = job["credits_page"]
+    hints = job["hints"]
+    faces = job["faces"]
+    offsets = job["offsets"]
+
     # load static pages if specified
+    title_frame = None
     if title_page:
         log("adding a title page:", title_page)
         title_rgb = cv2.imread(os.path.join(project, title_page),
@@ -114,14 +198,14 @@ def render_combined_video(project, resolution, results_dir,
     # open all the video clips and grab some quick stats
     videos = []
     durations = []
-    for i, file in enumerate(video_names):
+    for i, file in enumerate(job["video_names"]):
         v = VideoTrack()
         basename = os.path.basename(file)
         if basename in hints and "video_hide" in hints[basename]:
             log("not drawing video for:", file)
         else:
             path = os.path.join(project, file)
-            if v.open(path):
+            if v.probe(path):
                 durations.append(v.duration + offsets[i])
             if not faces is None and basename in faces:
                 v.face.data = faces[basename]
@@ -139,204 +223,377 @@ def render_combined_video(project, resolution, results_dir,
         #     # continue match offset time list by position
         #     videos.append(None)
     if len(durations) == 0:
-        return
+        return None
     duration = np.median(durations)
     duration += 4 # for credits/fade out
     log("median video duration (with fade to credits):", duration)
     
     if len(videos) == 0:
-        return
+        return None
 
-    # plan and setup the grid
-    options = { "frame_w": output_w,
-                "frame_h": output_h,
-                "spacing": 6,
-                "pad_top": pad_top,
-                "pad_bottom": pad_bottom,
-                "pad_left": pad_left,
-                "pad_right": pad_right,
-                "rows": rows }
-    grid = VideoGrid(videos, options)
-    #spiral = VideoSpiral(videos, output_w, output_h, border)
+    return { "title_frame": title_frame,
+             "credits_frame": credits_frame,
+             "videos": videos,
+             "duration": duration }
+
+# render the plan's frames from first on into output_file, the ones
+# before first are a pre-roll that is decoded but not drawn.  With
+# seek the tracks start at the plan's first frame instead of at their
+# beginning.  The audio_file (if any) is muxed in by the same encode,
+# the output frames are previewed as preview_name.
+def render_frames(scene, job, plan, first, output_file, seek=False,
+                  audio_file=None, preview_name="output"):
+    videos = scene["videos"]
+    duration = scene["duration"]
+    title_frame = scene["title_frame"]
+    credits_frame = scene["credits_frame"]
+    crop = job["crop"]
+    output_w = job["output_w"]
+    output_h = job["output_h"]
+    output_fps = job["output_fps"]
+    times = plan.times
+
+    for i, v in enumerate(videos):
+        if not plan.drawn[i]:
+            continue
+        basename = os.path.basename(job["video_names"][i])
+        log("decoding %s at %.0f%%" % (basename, 100 * plan.scale[i]))
+        start_time = 0
+        if seek:
+            start_time = max(plan.frame[0, i], 0) / plan.fps[i]
+        v.start(float(plan.scale[i]), int(plan.rotate[i]), output_fps,
+                start_time)
     
-    # open writer for output
-    output_file = os.path.join(results_dir, "silent_video.mp4")
-    inputdict, outputdict = gen_dicts(output_fps, "sane")
-    writer = skvideo.io.FFmpegWriter(output_file, inputdict=inputdict, outputdict=outputdict)
-    done = False
-    output_time = 0
-    pbar = tqdm(total=int(duration*output_fps), smoothing=0.05)
-    while output_time <= duration:
-        # fetch/update the frames for the current time step
-        for i, v in enumerate(videos):
-            if v.reader is None:
-                continue
-            basename = os.path.basename(video_names[i])
-            #print("basename:", basename)
-            rotate = 0
-            video_shift = 0
-            if basename in hints:
-                if "rotate" in hints[basename]:
-                    rotate = hints[basename]["rotate"]
-                if "video_shift" in hints[basename]:
-                    video_shift = hints[basename]["video_shift"]
-                if "face_detect" in hints[basename]:
-                    face_detect = hints[basename]["face_detect"]
-            local_time = output_time - offsets[i] - video_shift
-            v.get_frame(local_time, rotate)
-
-        # compute placement/size for each video frame (static grid strategy)
-        grid.update(videos, output_time)
-        #spiral.update(videos, output_time)
-
-        # scale/fit each frame to it's cell size
-        for i in range(len(videos)):
-            v = videos[i]
-            if v.reader is None:
-                continue
-            frame = v.raw_frame
-            if not frame is None:
-                (h, w) = frame.shape[:2]
-                vid_aspect = w/h
-                vid_landscape = (vid_aspect >= 1)
-                scale_w = v.size_w / w
-                scale_h = v.size_h / h
-                
-                background = None
-                if crop == "none":
-                    v.shaped_frame = video_crop.get_fit(frame, scale_w, scale_h,
-                                                        int(round(v.size_w)),
-                                                        int(round(v.size_h)))
-                elif crop == "fit":
-                    if grid.cell_landscape != vid_landscape:
-                        # background/wings full zoom
-                        background = video_crop.get_zoom(frame, scale_w, scale_h)
-                        background = cv2.blur(background, (43, 43))
-                        background = video_crop.clip_frame(background,
-                                                           v.size_w, v.size_h)
-                        # foreground compromise zoom/fit/arrangement
-                        avg = (scale_w + scale_h) * 0.5
-                        scale_w = avg
-                        scale_h = avg
-                        #print("scale:", scale_w, scale_h)
-                    frame_scale = video_crop.get_zoom(frame, scale_w, scale_h)
-                    frame_scale = video_crop.clip_frame(frame_scale,
-                                                        v.size_w, v.size_h)
-                    if background is None:
-                        v.shaped_frame = frame_scale
-                    else:
-                        v.shaped_frame = video_crop.overlay_frames(background, frame_scale)
-                elif crop == "face" or crop == "face-wide":
-                    basename = os.path.basename(video_names[i])
-                    if basename in hints and "face_detect" in hints[basename]:
-                        use_face = (hints[basename]["face_detect"] > 0.01)
-                        if not use_face:
-                            v.no_face()
-                    if crop == "face":
-                        v.shaped_frame = video_crop.fit_face(v)
-                    else:
-                        v.shaped_frame = video_crop.fit_face(v, pad=1.0)
-                    if v.shaped_frame.shape[1] < v.size_w:
-                        # need background fill
-                        background = video_crop.get_zoom(frame,
-                                                         scale_w, scale_h)
-                        background = cv2.blur(background, (43, 43))
-                        background = video_crop.clip_frame(background,
-                                                           v.size_w, v.size_h)
-                        v.shaped_frame = video_crop.overlay_frames(background, v.shaped_frame)
-                # cv2.imshow(video_names[i], frame_scale)
-            else:
-                # bummer video with no frames?
-                v.shaped_frame = None
+    # open writer for output (fed bgr frames straight from the
+    # compositor's buffers)
+    writer = VideoWriter(output_file, output_w, output_h, output_fps,
+                         audio_file, job["encoder"])
 
-        # draw the main frame
-        main_frame = np.zeros(shape=[output_h, output_w, 3], dtype=np.uint8)
+    # the render runs as three stages on their own threads, joined by
+    # small bounded queues: decode (pick each track's frame for the
+    # output time), composite (shape, place, fade) and encode.  Wall
+    # time is about the slowest stage instead of the sum of them.
+    decoded = queue.Queue(maxsize=render_queue)
+    composited = queue.Queue(maxsize=render_queue)
+    # preallocated output frames, cycled between compositor and encoder
+    free = queue.Queue()
+    for i in range(render_queue + 2):
+        free.put(np.zeros(shape=[output_h, output_w, 3], dtype=np.uint8))
+    compositor = Compositor()
+    tiles_shaped = 0
+    tiles_reused = 0
+    errors = []
 
-        # place each frame
-        sorted_vids = sorted(videos, key=lambda x: x.sort_order)
-        for v in sorted_vids:
-            frame = v.shaped_frame
-            if frame is None:
-                continue
-            nf = frame.copy()
-            x = int(v.place_x)
-            if x < 0:
-                diff = -x
-                if diff >= nf.shape[1]:
+    # queue helpers that give up when another stage failed (None)
+    def put(q, item):
+        while not len(errors):
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while not len(errors):
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def decode_stage(laps):
+        for n in range(len(times)):
+            laps.start()
+            # fetch/update the frames for the current time step, the
+            # compositor gets its own list because the tracks move on
+            # meanwhile
+            snapshot = []
+            for i, v in enumerate(videos):
+                if v.reader is None:
+                    snapshot.append(None)
                     continue
-                else:
-                    nf = nf[:,diff:]
-                    x = 0
-            if x > output_w - nf.shape[1]:
-                diff = x - (output_w - nf.shape[1])
-                if diff >= nf.shape[1]:
+                v.get_frame_num(plan.frame[n, i], plan.rotate[i])
+                snapshot.append( (v.raw_frame, v.raw_id) )
+            laps.lap("decode")
+            if not put(decoded, (n, snapshot)):
+                return
+        put(decoded, None)
+
+    def composite_stage(laps):
+        nonlocal tiles_shaped, tiles_reused
+        while True:
+            item = get(decoded)
+            if item is None:
+                break
+            (n, snapshot) = item
+            output_time = times[n]
+            laps.start()
+            # placement/size for each video frame
+            plan.place(n, videos)
+
+            # scale/fit each frame to it's cell size (unless the tile
+            # is the same as last time: same source frame, cell size
+            # and crop)
+            for i, v in enumerate(videos):
+                if snapshot[i] is None:
                     continue
-                else:
-                    nf = nf[:,:-diff]
-            y = int(v.place_y)
-            #print("y:", y, "shape:", nf.shape[:2])
-            if y < 0:
-                diff = -y
-                if diff >= nf.shape[0]:
+                (frame, raw_id) = snapshot[i]
+                rect = plan.crop[n, i]
+                key = (raw_id, v.size_w, v.size_h, tuple(rect))
+                if key == v.shaped_key:
+                    tiles_reused += 1
                     continue
+                v.shaped_frame = shape_frame(v, frame, plan.frame[n, i],
+                                             rect, crop, plan.cell_landscape)
+                v.shaped_key = key
+                tiles_shaped += 1
+            laps.lap("shape")
+            if n < first:
+                # pre-roll, only shaped so the wings are what a render
+                # from the start has by the first frame
+                continue
+
+            main_frame = get(free)
+            if main_frame is None:
+                break
+            compositor.draw(main_frame, videos,
+                            np.argsort(plan.z[n], kind="stable"))
+
+            if title_frame is not None and output_time <= 5:
+                if output_time < 4:
+                    alpha = 1
+                elif output_time >= 4 and output_time <= 5:
+                    alpha = (5 - output_time) / (5 - 4)
                 else:
-                    nf = nf[diff:,:]
-                    y = 0
-            if y >= output_h - nf.shape[0]:
-                diff = y - (output_h - nf.shape[0])
-                if diff >= nf.shape[0]:
-                    continue
+                    alpha = 0
+                #print("time:", output_time, "alpha:", alpha)
+                cv2.addWeighted(title_frame, alpha, main_frame, 1 - alpha, 0, dst=main_frame)
+                compositor.touched(main_frame)
+            elif output_time >= duration - 5:
+                if output_time >= duration - 4:
+                    alpha = 1
+                elif output_time >= duration - 5 and output_time < duration - 4:
+                    alpha = 1 - ((duration - 4) - output_time) / (5 - 4)
                 else:
-                    nf = nf[:-diff,:]
-            main_frame[y:y+nf.shape[0],x:x+nf.shape[1]] = nf
-
-        if title_page and output_time <= 5:
-            if output_time < 4:
-                alpha = 1
-            elif output_time >= 4 and output_time <= 5:
-                alpha = (5 - output_time) / (5 - 4)
-            else:
-                alpha = 0
-            #print("time:", output_time, "alpha:", alpha)
-            output_frame = cv2.addWeighted(title_frame, alpha, main_frame, 1 - alpha, 0)
-        elif output_time >= duration - 5:
-            if output_time >= duration - 4:
-                alpha = 1
-            elif output_time >= duration - 5 and output_time < duration - 4:
-                alpha = 1 - ((duration - 4) - output_time) / (5 - 4)
-            else:
-                alpha = 0
-            #print("time:", output_time, "alpha:", alpha)
-            output_frame = cv2.addWeighted(credits_frame, alpha, main_frame, 1 - alpha, 0)
-        else:
-            output_frame = main_frame
-        cv2.imshow("output", output_frame)
-        cv2.waitKey(1)
+                    alpha = 0
+                #print("time:", output_time, "alpha:", alpha)
+                cv2.addWeighted(credits_frame, alpha, main_frame, 1 - alpha, 0, dst=main_frame)
+                compositor.touched(main_frame)
+            laps.lap("composite")
+            preview.show(preview_name, main_frame)
+            laps.lap("preview")
+            if not put(composited, main_frame):
+                return
+        put(composited, None)
 
-        # write the frame as RGB not BGR
-        writer.writeFrame(output_frame[:,:,::-1])
-        
-        output_time += 1 / output_fps
-        pbar.update(1)
+    def run_stage(func, laps):
+        try:
+            func(laps)
+        except Exception as e:
+            log("render stage failed:", func.__name__, repr(e))
+            errors.append(e)
+
+    stage_laps = [ metrics.Laps(), metrics.Laps(), metrics.Laps() ]
+    threads = [ threading.Thread(target=run_stage, args=(decode_stage, stage_laps[0])),
+                threading.Thread(target=run_stage, args=(composite_stage, stage_laps[1])) ]
+    for t in threads:
+        t.start()
+
+    # encode on this thread
+    frames = 0
+    laps = stage_laps[2]
+    pbar = tqdm(total=len(times) - first, smoothing=0.05)
+    try:
+        while True:
+            main_frame = get(composited)
+            if main_frame is None:
+                break
+            laps.start()
+            writer.write(main_frame)
+            laps.lap("encode")
+            free.put(main_frame)
+            frames += 1
+            pbar.update(1)
+    except Exception as e:
+        # let the other stages know
+        errors.append(e)
     pbar.close()
+    for t in threads:
+        t.join()
+    for v in videos:
+        v.close()
+    laps.start()
     writer.close()
-    log("gridded video (only) file: silent_video.mp4")
-    
-def merge(project, results_dir):
-    log("video: merging video and audio into final result: gridded_video.mp4")
-    # use ffmpeg to combine the video and audio tracks into the final movie
-    input_video = os.path.join(results_dir, "silent_video.mp4")
-    input_audio = os.path.join(results_dir, "full-mix.mp3")
-    output_video = os.path.join(results_dir, "gridded_video.mp4")
-    result = call(["ffmpeg", "-i", input_video, "-i", input_audio, "-c:v", "copy", "-c:a", "aac", "-y", output_video])
+    laps.lap("encode")
+    if len(errors):
+        raise errors[0]
+    log("tiles shaped:", tiles_shaped, "reused:", tiles_reused)
+    # busy time per phase (the stages overlap)
+    totals = {}
+    for l in stage_laps:
+        totals.update(l.totals)
+    return frames, totals
+
+# render the output in chunks on worker processes and join them
+# without encoding the video again (the audio is added by the join)
+def render_chunks(job, plan, chunks, output_file, audio_file=None):
+    results_dir = os.path.dirname(output_file)
+    frame_count = len(plan.times)
+    size = int(math.ceil(frame_count / chunks))
+    preroll = int(round(chunk_preroll * job["output_fps"]))
+    log("rendering in", chunks, "chunks of", size, "frames")
+    procs = ProcessPoolExecutor(max_workers=chunks,
+                                initializer=logger.init,
+                                initargs=(logger.logfile,))
+    futures = []
+    chunk_files = []
+    for c in range(chunks):
+        first = c * size
+        last = min(first + size, frame_count)
+        start = max(first - preroll, 0)
+        chunk_file = os.path.join(results_dir, "chunk-%03d.mp4" % c)
+        futures.append( procs.submit(render_chunk, job,
+                                     plan.slice(start, last), first - start,
+                                     chunk_file, first > 0) )
+        chunk_files.append(chunk_file)
+    frames = 0
+    totals = {}
+    try:
+        for future in futures:
+            (chunk_frames, chunk_totals), records = future.result()
+            metrics.merge(records)
+            frames += chunk_frames
+            for p in chunk_totals:
+                totals[p] = totals.get(p, 0.0) + chunk_totals[p]
+    finally:
+        procs.shutdown()
+
+    # join the chunks (same encoder settings, each starts on a key frame)
+    list_file = os.path.join(results_dir, "chunks.txt")
+    with open(list_file, "w") as fp:
+        for chunk_file in chunk_files:
+            fp.write("file '%s'\n" % os.path.basename(chunk_file))
+    command = [ "ffmpeg", "-f", "concat", "-safe", "0", "-i", list_file ]
+    if audio_file is not None:
+        command += [ "-i", audio_file, "-map", "0:v:0", "-map", "1:a:0",
+                     "-c:a", "aac" ]
+    result = call(command + [ "-c:v", "copy", "-y", output_file ])
     print("ffmpeg result code:", result)
+    if result != 0:
+        raise RuntimeError("joining the video chunks failed")
+    os.unlink(list_file)
+    for chunk_file in chunk_files:
+        os.unlink(chunk_file)
+    return frames, totals
+
+# one chunk of the render, in a worker process (ships its metrics back)
+# with a preview of its own (preview-output-chunk-NNN.jpg)
+def render_chunk(job, plan, first, output_file, seek):
+    metrics.drain()             # forked copies of the parent's records
+    basename, ext = os.path.splitext(os.path.basename(output_file))
+    preview_name = "output-" + basename
+    try:
+        with metrics.stage("render_chunk"):
+            scene = setup_scene(job)
+            result = render_frames(scene, job, plan, first, output_file,
+                                   seek, preview_name=preview_name)
+    finally:
+        preview.close(preview_name)
+    return result, metrics.drain()
+
+# scale/fit a (raw) frame (source frame number frame_num) to its cell
+# size, rect is the part of it the plan shows (see
+# video_crop.crop_rect).  The arrays it works in are kept on the track
+# and reused for the next frame.
+def shape_frame(v, frame, frame_num, rect, crop, cell_landscape):
+    if frame is None:
+        # bummer video with no frames?
+        return None
+    (h, w) = frame.shape[:2]
+    vid_aspect = w/h
+    vid_landscape = (vid_aspect >= 1)
+    scale_w = v.size_w / w
+    scale_h = v.size_h / h
 
+    shaped_frame = None
+    background = None
+    if crop == "none":
+        shaped_frame = video_crop.get_fit(frame, scale_w, scale_h,
+                                          int(round(v.size_w)),
+                                          int(round(v.size_h)),
+                                          v.buffers)
+    elif crop == "fit":
+        if cell_landscape != vid_landscape:
+            # background/wings full zoom
+            background = get_wings(v, frame, frame_num, scale_w, scale_h)
+            # foreground compromise zoom/fit/arrangement
+            avg = (scale_w + scale_h) * 0.5
+            scale_w = avg
+            scale_h = avg
+            #print("scale:", scale_w, scale_h)
+        frame_scale = video_crop.get_zoom(frame, scale_w, scale_h,
+                                          v.buffers.get("scale"))
+        v.buffers["scale"] = frame_scale
+        frame_scale = video_crop.clip_frame(frame_scale,
+                                            v.size_w, v.size_h)
+        if background is None:
+            shaped_frame = frame_scale
+        else:
+            shaped_frame = video_crop.overlay_frames(background, frame_scale)
+    elif crop == "face" or crop == "face-wide":
+        shaped_frame = video_crop.fit_face(v, frame, rect)
+        if shaped_frame.shape[1] < v.size_w:
+            # need background fill
+            background = get_wings(v, frame, frame_num, scale_w, scale_h)
+            shaped_frame = video_crop.overlay_frames(background, shaped_frame)
+    # cv2.imshow(video_names[i], frame_scale)
+    return shaped_frame
+
+# the blurred full zoom that fills the cell behind a frame that
+# doesn't.  It is blurred small and scaled up, and only redrawn every
+# wings_refresh source frames (or on a scene change), the returned tile
+# is a copy to draw the frame over.
+def get_wings(v, frame, frame_num, scale_w, scale_h):
+    cell_w = int(round(v.size_w))
+    cell_h = int(round(v.size_h))
+    wings = v.buffers.get("wings")
+    # a sparse sample of the frame is plenty to notice a new scene
+    sample = frame[::16,::16]
+    last = v.buffers.get("wings_sample")
+    if wings is None or wings.shape[:2] != (cell_h, cell_w) \
+       or frame_num % wings_refresh == 0 or last.shape != sample.shape \
+       or np.mean(cv2.absdiff(sample, last)) > scene_change:
+        # full zoom at 1/wings_shrink size, blurred
+        zoom = max(scale_w, scale_h) / wings_shrink
+        small = cv2.resize(frame, None, fx=zoom, fy=zoom,
+                           interpolation=cv2.INTER_AREA)
+        size = max(int(round(43 / wings_shrink)) | 1, 3)
+        small = cv2.blur(small, (size, size))
+        # the middle part that covers the cell, back at full size
+        (small_h, small_w) = small.shape[:2]
+        w = min(max(int(round(cell_w / wings_shrink)), 1), small_w)
+        h = min(max(int(round(cell_h / wings_shrink)), 1), small_h)
+        x = int((small_w - w) * 0.5)
+        y = int((small_h - h) * 0.5)
+        wings = cv2.resize(small[y:y+h,x:x+w], (cell_w, cell_h), dst=wings,
+                           interpolation=cv2.INTER_LINEAR)
+        v.buffers["wings"] = wings
+        v.buffers["wings_sample"] = sample.copy()
+    tile = v.buffers.get("wings_tile")
+    if tile is None or tile.shape != wings.shape:
+        tile = np.empty_like(wings)
+        v.buffers["wings_tile"] = tile
+    np.copyto(tile, wings)
+    return tile
+    
 # https://superuser.com/questions/258032/is-it-possible-to-use-ffmpeg-to-trim-off-x-seconds-from-the-beginning-of-a-video/269960
 # ffmpeg -i input.flv -ss 2 -vcodec copy -acodec copy output.flv
 #   -vcodec libx264 -crf 0
 
 #ffmpeg -f lavfi -i color=c=black:s=1920x1080:r=25:d=1 -i testa444.mov -filter_complex "[0:v] trim=start_frame=1:end_frame=5 [blackstart]; [0:v] trim=start_frame=1:end_frame=3 [blackend]; [blackstart] [1:v] [blackend] concat=n=3:v=1:a=0[out]" -map "[out]" -c:v qtrle -c:a copy -timecode 01:00:00:00 test16.mov
 
+@metrics.timed("video.save_aligned")
 def save_aligned(project, results_dir, video_names, sync_offsets):
     if False:
         # first clean out any previous aligned_audio tracks in case tracks
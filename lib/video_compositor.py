@@ -0,0 +1,71 @@
+# draw the shaped video tiles into output frames without allocating
+# anything per frame.  The output frames (canvases) are kept and cycled
+# by the caller; the compositor remembers the tiles it drew on each one,
+# so only the parts no tile covers anymore are cleared, and the tiles
+# are copied straight into views of the canvas.
+
+import numpy as np
+
+class Compositor:
+    def __init__(self):
+        # id(canvas) -> rects (x, y, w, h) drawn on it last time, None
+        # if all of it was drawn over
+        self.drawn = {}
+
+    # draw the videos' shaped frames, order is bottom to top (clipped
+    # to the canvas)
+    def draw(self, canvas, videos, order):
+        (output_h, output_w) = canvas.shape[:2]
+        tiles = []
+        for i in order:
+            nf = videos[i].shaped_frame
+            if nf is None:
+                continue
+            x = int(videos[i].place_x)
+            if x < 0:
+                diff = -x
+                if diff >= nf.shape[1]:
+                    continue
+                else:
+                    nf = nf[:,diff:]
+                    x = 0
+            if x > output_w - nf.shape[1]:
+                diff = x - (output_w - nf.shape[1])
+                if diff >= nf.shape[1]:
+                    continue
+                else:
+                    nf = nf[:,:-diff]
+            y = int(videos[i].place_y)
+            #print("y:", y, "shape:", nf.shape[:2])
+            if y < 0:
+                diff = -y
+                if diff >= nf.shape[0]:
+                    continue
+                else:
+                    nf = nf[diff:,:]
+                    y = 0
+            if y > output_h - nf.shape[0]:
+                diff = y - (output_h - nf.shape[0])
+                if diff >= nf.shape[0]:
+                    continue
+                else:
+                    nf = nf[:-diff,:]
+            tiles.append( (x, y, nf) )
+        rects = [ (x, y, nf.shape[1], nf.shape[0]) for (x, y, nf) in tiles ]
+
+        # clear what was drawn last time and won't be drawn over now
+        last = self.drawn.get(id(canvas), [])
+        if last is None:
+            canvas.fill(0)
+        else:
+            for rect in last:
+                if not rect in rects:
+                    (x, y, w, h) = rect
+                    canvas[y:y+h,x:x+w] = 0
+        for (x, y, nf) in tiles:
+            np.copyto(canvas[y:y+nf.shape[0],x:x+nf.shape[1]], nf)
+        self.drawn[id(canvas)] = rects
+
+    # the whole canvas was drawn over (title/credits fades)
+    def touched(self, canvas):
+        self.drawn[id(canvas)] = None
@@ -1,15 +1,29 @@
 import cv2
+import math
 import numpy as np
 
-# return a scaled versino of the frame that fits
-def get_fit(frame, scale_w, scale_h, cell_w, cell_h):
-    cell = np.zeros(shape=[cell_h, cell_w, 3], dtype=np.uint8)
+# return a scaled versino of the frame that fits (buffers, if given,
+# keeps the arrays for reuse by the next call)
+def get_fit(frame, scale_w, scale_h, cell_w, cell_h, buffers=None):
+    if buffers is None:
+        buffers = {}
+    last = buffers.get("fit")
     if scale_w < scale_h:
         result = cv2.resize(frame, None, fx=scale_w, fy=scale_w,
+                            dst=buffers.get("fit"),
                             interpolation=cv2.INTER_AREA)
     else:
         result = cv2.resize(frame, None, fx=scale_h, fy=scale_h,
+                            dst=buffers.get("fit"),
                             interpolation=cv2.INTER_AREA)
+    buffers["fit"] = result
+    cell = buffers.get("cell")
+    if cell is None or cell.shape[:2] != (cell_h, cell_w):
+        cell = np.zeros(shape=[cell_h, cell_w, 3], dtype=np.uint8)
+        buffers["cell"] = cell
+    elif last is None or last.shape != result.shape:
+        cell.fill(0)
+    # else the letterbox bars are still black
     if cell_w > result.shape[1]:
         x = int((cell_w - result.shape[1])*0.5)
     else:
@@ -22,18 +36,19 @@ def get_fit(frame, scale_w, scale_h, cell_w, cell_h):
     return cell
 
 # return a scaled version of the frame that stretches vertically and
-# is cropped (if needed) horizontally
-def get_fit_height(frame, scale_h):
-    result = cv2.resize(frame, None, fx=scale_h, fy=scale_h,
+# is cropped (if needed) horizontally.  dst is reused if it is the
+# right size (i.e. the result of the last call.)
+def get_fit_height(frame, scale_h, dst=None):
+    result = cv2.resize(frame, None, fx=scale_h, fy=scale_h, dst=dst,
                         interpolation=cv2.INTER_AREA)
     return result
 
-def get_zoom(frame, scale_w, scale_h):
+def get_zoom(frame, scale_w, scale_h, dst=None):
     if scale_w < scale_h:
-        result = cv2.resize(frame, None, fx=scale_h, fy=scale_h,
+        result = cv2.resize(frame, None, fx=scale_h, fy=scale_h, dst=dst,
                             interpolation=cv2.INTER_AREA)
     else:
-        result = cv2.resize(frame, None, fx=scale_w, fy=scale_w,
+        result = cv2.resize(frame, None, fx=scale_w, fy=scale_w, dst=dst,
                             interpolation=cv2.INTER_AREA)
     return result
         
@@ -62,36 +77,69 @@ def overlay_frames(bg, fg):
     bg[y:y+fg.shape[0],x:x+fg.shape[1]] = fg
     return bg
 
-def fit_face(v, pad=0.5):
+# how small (relative to its display size) a video can be decoded and
+# still fill a cell_w x cell_h cell at full detail with this crop mode:
+# the zoom to fill the cell, or for face crops the zoom onto the
+# smallest face (with some margin.)  1.0 is full size.
+face_margin = 1.5
+def decode_scale(v, cell_w, cell_h, crop, rotate=0):
+    (w, h) = (v.w, v.h)
+    if rotate in [ 90, 270 ]:
+        (w, h) = (h, w)
+    scale = max(cell_w / w, cell_h / h)
+    if crop == "face" or crop == "face-wide":
+        if crop == "face":
+            pad = 0.5
+        else:
+            pad = 1.0
+        heights = [ f["bottom"] - f["top"] for f in v.face.data ]
+        heights = [ fh for fh in heights if fh > 0 ]
+        if len(heights):
+            face_scale = cell_h / (min(heights) * (1 + 3*pad))
+            scale = max(scale, face_scale * face_margin)
+    return min(scale, 1.0)
+
+# the part of a framew x frameh (decoded) frame to show in a size_w x
+# size_h cell with this crop mode, as (x, y, w, h) in frame pixels.
+# scale is the decoded size relative to the display size (face data
+# is at display size.)
+def crop_rect(v, crop, framew, frameh, size_w, size_h, local_time,
+              scale=1.0, cell_landscape=True, use_face=True):
+    if crop == "none":
+        return (0, 0, framew, frameh)
+    elif crop == "fit":
+        # the middle of the zoomed frame (see shape_frame)
+        scale_w = size_w / framew
+        scale_h = size_h / frameh
+        if cell_landscape != (framew / frameh >= 1):
+            avg = (scale_w + scale_h) * 0.5
+            scale_w = avg
+            scale_h = avg
+        zoom = max(scale_w, scale_h)
+        w = min(framew, size_w / zoom)
+        h = min(frameh, size_h / zoom)
+        return ((framew - w) * 0.5, (frameh - h) * 0.5, w, h)
+    elif crop == "face":
+        return face_crop(v, framew, frameh, size_w, size_h, local_time,
+                         scale, use_face=use_face)
+    elif crop == "face-wide":
+        return face_crop(v, framew, frameh, size_w, size_h, local_time,
+                         scale, pad=1.0, use_face=use_face)
+
+# frame the face (with some room around it) at the cell's aspect ratio,
+# to the subpixel
+def face_crop(v, framew, frameh, size_w, size_h, local_time, scale=1.0,
+              pad=0.5, use_face=True):
     #print("face.count:", v.face.count)
-    if v.face.count > 5 and not v.local_time is None:
-        (l, r, t, b) = v.face.get_face(v.local_time, 1.0)
+    if use_face and v.face.count > 5 and not local_time is None:
+        # faces are found at full size, frames may be decoded smaller
+        (l, r, t, b) = v.face.get_face(local_time, scale)
         #print("face:", l, r, t, b)
     else:
-        (b, r) = v.raw_frame.shape[:2]
+        (b, r) = (frameh, framew)
         l = 0
         t = 0
-    face_area = (r - l) * (b - t)
-    cell_area = v.size_w * v.size_h
-    #print("face_area:", face_area, "cell_area:", cell_area)
-    if face_area < 2 * cell_area:
-        # try something crazy (subpixel cropping by scaling up and
-        # then back down)
-        scale = 2.0
-        superscale = cv2.resize(v.raw_frame, None, fx=scale, fy=scale,
-                                interpolation=cv2.INTER_AREA)
-        l = l * scale
-        r = r * scale
-        t = t * scale
-        b = b * scale
-    else:
-        superscale = v.raw_frame
-    (frameh, framew) = superscale.shape[:2]
-    frame_ar = framew / frameh
-    size_ar = v.size_w / v.size_h
-        
-    #v.raw_frame = cv2.rectangle(np.array(v.raw_frame), (x,y), (x+w,y+h), (0,255,0), 2)
-    #print(" ", x,y,w,h)
+    size_ar = size_w / size_h
 
     w = r - l
     h = b - t
@@ -114,10 +162,6 @@ def fit_face(v, pad=0.5):
     wantt = t - (wanth - h) * 0.333
 
     # don't ask for more than the frame has
-    wantl = int(round(wantl))
-    wantt = int(round(wantt))
-    wantw = int(round(wantw))
-    wanth = int(round(wanth))
     if wantw > framew:
         wantw = framew
     if wanth > frameh:
@@ -133,21 +177,60 @@ def fit_face(v, pad=0.5):
     # v.raw_frame = cv2.rectangle(np.array(v.raw_frame), (wantx,wanty), (wantx+wantw,wanty+wanth), (255,255,255), 2)
     #cv2.imshow(str(v.reader), v.raw_frame)
 
-    # best fit we can make on the face with original aspect ratio
-    crop = superscale[wantt:wantt+wanth, wantl:wantl+wantw]
-    #cv2.imshow(str(v.reader) + " crop", crop)
+    return (wantl, wantt, wantw, wanth)
 
-    # now cram it into the available space (lossy/zoom)
-    croph, cropw = crop.shape[:2]
-    if croph == 0:
+# frame is passed in because the track may have moved on to later
+# frames already, rect is the face_crop().  The crop is scaled to the
+# cell height and cut to the cell width (like get_fit_height() and
+# clip_frame()) in one warp that only reads the part of the frame it
+# covers.  Crops that shrink are area averaged instead (a warp would
+# alias.)
+def fit_face(v, frame, rect):
+    (x, y, w, h) = [ float(c) for c in rect ]
+    (frameh, framew) = frame.shape[:2]
+    if w < 1 or h < 1:
         # debug
-        print("l,r,t,b:", l, r, t, b)
-        print("want:", wantl, wantt, wantw, wanth)
-        print("crop shape:", crop.shape)
-        print("name:", v.file, "face:", l, r, t, b)
-    scale_h = v.size_h / croph
-    final = get_fit_height(crop, scale_h)
-    final = clip_frame(final, v.size_w, v.size_h)
+        print("name:", v.file, "rect:", rect)
+        (x, y, w, h) = (0, 0, framew, frameh)
+    scale = v.size_h / h
+    if scale < 1:
+        crop = frame[int(round(y)):int(round(y + h)),
+                     int(round(x)):int(round(x + w))]
+        final = get_fit_height(crop, v.size_h / crop.shape[0],
+                               v.buffers.get("face"))
+        v.buffers["face"] = final
+        return clip_frame(final, v.size_w, v.size_h)
+
+    # final size and the cut from the middle
+    fit_w = int(round(w * scale))
+    fit_h = int(round(h * scale))
+    out_w = min(fit_w, int(round(v.size_w)))
+    out_h = min(fit_h, int(round(v.size_h)))
+    cutw = 0
+    cuth = 0
+    if fit_w > v.size_w:
+        cutw = int(round((fit_w - v.size_w) * 0.5))
+    if fit_h > v.size_h:
+        cuth = int(round((fit_h - v.size_h) * 0.5))
+
+    # the part of the frame under the crop (and a pixel around it for
+    # the interpolation)
+    x0 = max(int(math.floor(x)) - 1, 0)
+    y0 = max(int(math.floor(y)) - 1, 0)
+    x1 = min(int(math.ceil(x + w)) + 1, framew)
+    y1 = min(int(math.ceil(y + h)) + 1, frameh)
+    roi = frame[y0:y1,x0:x1]
+    # output pixel (u, v) comes from the crop at (u + cutw + 0.5) /
+    # scale - 0.5 (pixel centers)
+    M = np.array([ [ 1 / scale, 0, x - x0 + (cutw + 0.5) / scale - 0.5 ],
+                   [ 0, 1 / scale, y - y0 + (cuth + 0.5) / scale - 0.5 ] ])
+    final = v.buffers.get("face")
+    if final is None or final.shape[:2] != (out_h, out_w):
+        final = np.empty(shape=[out_h, out_w, 3], dtype=np.uint8)
+    final = cv2.warpAffine(roi, M, (out_w, out_h), dst=final,
+                           flags=cv2.INTER_LINEAR|cv2.WARP_INVERSE_MAP,
+                           borderMode=cv2.BORDER_REPLICATE)
+    v.buffers["face"] = final
     #cv2.imshow(str(v.reader) + " final", final)
 
     # shape_ar = v.size_w / v.size_h
@@ -1,10 +1,10 @@
 import cv2
-import dlib
 import math
-import matplotlib.pyplot as plt
 import numpy as np
 import random
 
+from . import preview
+
 def gen_func( coeffs, min, max, steps ):
     if abs(max-min) < 0.0001:
         max = min + 0.1
@@ -58,9 +58,9 @@ class FaceDetect():
         self.left_func = np.poly1d(left_fit)
         #print("left fit:", left_fit)
         #print("left res:", res)
-        xvals, yvals = gen_func(left_fit,time[0], time[-1], 1000)
-        plt.scatter(time, left, marker='*', label="Left")
-        plt.plot(xvals, yvals, label="Left Fit")
+        #xvals, yvals = gen_func(left_fit,time[0], time[-1], 1000)
+        #plt.scatter(time, left, marker='*', label="Left")
+        #plt.plot(xvals, yvals, label="Left Fit")
         right_fit, res, _, _, _ = np.polyfit( time, right, degree, full=True )
         self.right_func = np.poly1d(right_fit)
         #xvals, yvals = gen_func(right_fit,time[0], time[-1], 1000)
@@ -132,6 +132,9 @@ class FaceDetect():
             scale = 1
             frame = raw_frame.copy()
             
+        # only face detection needs dlib (rendering just uses the
+        # cached face data)
+        import dlib
         rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         detector = dlib.get_frontal_face_detector()
         detections = detector(rgb, 1)
@@ -177,7 +180,6 @@ class FaceDetect():
             (l, r, t, b) = (0, frame.shape[1], 0, frame.shape[0])
         frame = cv2.rectangle(np.array(frame), (int(l), int(t)), (int(r), int(b)), (255,255,255), 2)
         
-        cv2.imshow('face detection', frame)
-        cv2.waitKey(1)
+        preview.show("faces", frame)
 
         return (l, r, t, b)
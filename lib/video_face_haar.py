@@ -62,7 +62,7 @@ class FaceDetect():
             
         gray = cv2.cvtColor(raw_frame, cv2.COLOR_BGR2GRAY)
         gray = self.clahe.apply(gray)
-        cv2.imshow('gray', gray)
+        #cv2.imshow('gray', gray)
         faces = face_cascade.detectMultiScale(gray, 1.2, 5, minSize=(30,30))
         #faces = face_cascade.detectMultiScale(gray, 1.2, 3)
         biggest_index = -1
@@ -1,14 +1,15 @@
-import cv2
 import json
 import os
 from tqdm import tqdm
 
 from .logger import log
+from . import metrics
 from .video_track import VideoTrack
 
 # how many samples to take (more is better, but slower)
 num_samples = 100
 
+@metrics.timed("find_faces")
 def find_faces(project, video_names, hints):
     # load any existing faces
     face_file = os.path.join(project, "results", "faces.json")
@@ -17,19 +18,31 @@ def find_faces(project, video_names, hints):
             faces = json.load(fp)
     else:
         faces = {}
+    # the rotate hint each face was found with
+    rotate_file = os.path.join(project, "results", "faces-rotate.json")
+    if os.path.exists(rotate_file):
+        with open(rotate_file, "r") as fp:
+            rotations = json.load(fp)
+    else:
+        rotations = {}
 
     # let's find any missing faces
     for i, file in enumerate(video_names):
         basename = os.path.basename(file)
+        rotate = 0
+        if basename in hints and "rotate" in hints[basename]:
+            rotate = hints[basename]["rotate"]
+        if basename in faces and rotations.get(basename, 0) != rotate:
+            log("rotate hint changed, finding faces again:", file)
+            del faces[basename]
         if basename in faces:
+            metrics.cache(hit=True)
             continue
         if basename in hints and "video_hide" in hints[basename]:
             log("not detecting faces in hidden video:", file)
             continue
-        rotate = 0
-        if basename in hints and "rotate" in hints[basename]:
-            rotate = hints[basename]["rotate"]
 
+        metrics.cache(hit=False)
         path = os.path.join(project, file)
         v = VideoTrack()
         if not v.open(path):
@@ -37,27 +50,29 @@ def find_faces(project, video_names, hints):
             continue
 
         # walk through video by time
-        pbar = tqdm(total=v.duration, smoothing=0.05)
-        time = 0
-        dt = v.duration / num_samples
-        if dt < 1:
-            # no more than onen sample a second
-            dt = 1
-        while not v.frame is None:
-            v.get_frame(time, rotate)
-            v.face.find_face(v.raw_frame, time)
-            pbar.update(dt)
-            time += dt
-        pbar.close()
+        with metrics.stage("find_faces.track", track=file):
+            pbar = tqdm(total=v.duration, smoothing=0.05)
+            time = 0
+            dt = v.duration / num_samples
+            if dt < 1:
+                # no more than onen sample a second
+                dt = 1
+            while not v.frame is None:
+                v.get_frame(time, rotate)
+                v.face.find_face(v.raw_frame, time)
+                pbar.update(dt)
+                time += dt
+            pbar.close()
+        v.close()
         faces[basename] = v.face.data
+        rotations[basename] = rotate
         
         # save/cache face location data (each iteration so we can
         # restart if needed)
         face_file = os.path.join(project, "results", "faces.json")
         with open(face_file, "w") as fp:
             json.dump(faces, fp, indent=4)
+        with open(rotate_file, "w") as fp:
+            json.dump(rotations, fp, indent=4)
 
-    # close our face preview window
-    cv2.destroyAllWindows()
-    
     return faces
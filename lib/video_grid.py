@@ -1,5 +1,5 @@
 import math
-from random import randrange
+from random import Random
 
 from .logger import log
 
@@ -16,15 +16,19 @@ class VideoGrid:
         self.pad_left = options["pad_left"]
         self.pad_right = options["pad_right"]
         rows = options["rows"]
+        # the same seed gives the same entrance every time
+        self.random = Random(options.get("seed", 0))
         self.place_count = 0
         self.even_offset = self.frame_w
         self.last_placed_row = 0
         num_portrait = 0
         num_landscape = 0
+        # (the grid is planned before the videos start decoding, so
+        # it goes by their probed display sizes)
         for v in videos:
-            if v.reader is None or v.frame is None:
+            if not v.probed:
                 continue
-            (h, w) = v.frame.shape[:2]
+            (h, w) = (v.h, v.w)
             if w > h:
                 num_landscape += 1
             else:
@@ -36,7 +40,7 @@ class VideoGrid:
         else:
             log("landscape dominant input videos")
 
-        num_good_videos = sum(v.reader is not None for v in videos)
+        num_good_videos = sum(v.probed for v in videos)
         log("Number of videos to place:", num_good_videos)
         if not rows is None:
             # we have a number of rows request to honor
@@ -111,7 +115,7 @@ class VideoGrid:
         sorted_vids = videos
         #print("sorted:", len(sorted_vids))
         for v in sorted_vids:
-            if v.reader is None:
+            if not v.probed:
                 continue
             #print(row, col)
             row_info = self.rows[row]
@@ -126,7 +130,7 @@ class VideoGrid:
                 v.sort_order = self.place_count
                 if row > self.last_placed_row:
                     self.last_placed_row = row
-                    self.even_offset = self.frame_w + randrange(int(cell_w))
+                    self.even_offset = self.frame_w + self.random.randrange(int(cell_w))
                 if concert_entrance:
                     if v.place_x is None:
                         v.place_x = self.even_offset
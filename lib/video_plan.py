@@ -0,0 +1,137 @@
+# the render plan: everything about the output video that changes over
+# time (which frame of each track is shown, what part of it, where it
+# goes and what is drawn over what), worked out for every output frame
+# before anything is decoded.  The grid's random entrance comes from a
+# fixed seed, so the same project plans the same video every time, and
+# any frame can be drawn without drawing the ones before it (chunked
+# renders, caches.)
+
+import numpy as np
+import os
+
+from .logger import log
+from . import video_crop
+from .video_grid import VideoGrid
+
+seed = 0                        # for the grid entrance
+
+class RenderPlan:
+    def __init__(self, times, tracks):
+        n = len(times)
+        self.times = np.array(times, dtype=np.float64)
+        # per output frame and track: source frame number (-1 before
+        # the track starts), source crop (x, y, w, h in decoded frame
+        # pixels), destination (x, y, w, h in the output frame) and z
+        # order (lowest is drawn first)
+        self.frame = np.full((n, tracks), -1, dtype=np.int32)
+        self.crop = np.zeros((n, tracks, 4), dtype=np.float32)
+        self.dest = np.zeros((n, tracks, 4), dtype=np.float32)
+        self.z = np.full((n, tracks), 999999, dtype=np.int32)
+        # per track: drawn at all, decode scale, rotation and fps
+        self.drawn = np.zeros(tracks, dtype=bool)
+        self.scale = np.ones(tracks, dtype=np.float32)
+        self.rotate = np.zeros(tracks, dtype=np.int32)
+        self.fps = np.zeros(tracks, dtype=np.float64)
+        self.cell_landscape = True
+
+    # output frames [start, end) as a plan of their own
+    def slice(self, start, end):
+        plan = RenderPlan([], len(self.drawn))
+        plan.times = self.times[start:end]
+        plan.frame = self.frame[start:end]
+        plan.crop = self.crop[start:end]
+        plan.dest = self.dest[start:end]
+        plan.z = self.z[start:end]
+        plan.drawn = self.drawn
+        plan.scale = self.scale
+        plan.rotate = self.rotate
+        plan.fps = self.fps
+        plan.cell_landscape = self.cell_landscape
+        return plan
+
+    # put the videos where they are at output frame n
+    def place(self, n, videos):
+        for i, v in enumerate(videos):
+            if self.drawn[i]:
+                (v.place_x, v.place_y, v.size_w, v.size_h) = self.dest[n, i]
+                v.sort_order = self.z[n, i]
+
+# plan a render of the (probed) videos, job is the render setup (see
+# video.render_combined_video)
+def make_plan(videos, job, duration):
+    output_fps = job["output_fps"]
+    hints = job["hints"]
+    offsets = job["offsets"]
+    crop = job["crop"]
+    times = []
+    output_time = 0
+    while output_time <= duration:
+        times.append(output_time)
+        output_time += 1 / output_fps
+    plan = RenderPlan(times, len(videos))
+
+    # plan and setup the grid
+    options = { "frame_w": job["output_w"],
+                "frame_h": job["output_h"],
+                "spacing": 6,
+                "pad_top": job["pad_top"],
+                "pad_bottom": job["pad_bottom"],
+                "pad_left": job["pad_left"],
+                "pad_right": job["pad_right"],
+                "rows": job["rows"],
+                "seed": seed }
+    grid = VideoGrid(videos, options)
+    #spiral = VideoSpiral(videos, output_w, output_h, border)
+    plan.cell_landscape = grid.cell_landscape
+
+    # decode each video at about the size it is drawn at (ffmpeg does
+    # the scaling, rotation and frame rate conversion)
+    cell_w = max([ row["cell_w"] for row in grid.rows ])
+    cell_h = max([ row["cell_h"] for row in grid.rows ])
+    video_shifts = []
+    use_faces = []
+    sizes = []
+    face_scales = []
+    for i, v in enumerate(videos):
+        basename = os.path.basename(job["video_names"][i])
+        track_hints = hints.get(basename, {})
+        video_shifts.append(track_hints.get("video_shift", 0))
+        use_faces.append(track_hints.get("face_detect", 1) > 0.01)
+        if not v.probed:
+            sizes.append(None)
+            face_scales.append(None)
+            continue
+        rotate = track_hints.get("rotate", 0)
+        plan.drawn[i] = True
+        plan.rotate[i] = rotate
+        plan.scale[i] = video_crop.decode_scale(v, cell_w, cell_h, crop,
+                                                rotate)
+        plan.fps[i] = v.decode_fps(output_fps)
+        sizes.append(v.decode_size(plan.scale[i], rotate))
+        # faces are found at full (display) size
+        face_scales.append(v.decode_size(plan.scale[i])[0] / v.w)
+
+    for n, output_time in enumerate(times):
+        # compute placement/size for each video frame (static grid strategy)
+        grid.update(videos, output_time)
+        #spiral.update(videos, output_time)
+        for i, v in enumerate(videos):
+            if not plan.drawn[i]:
+                continue
+            plan.dest[n, i] = (v.place_x, v.place_y, v.size_w, v.size_h)
+            plan.z[n, i] = v.sort_order
+            local_time = output_time - offsets[i] - video_shifts[i]
+            frame_num = int(round(local_time * plan.fps[i]))
+            if frame_num < 0:
+                continue
+            plan.frame[n, i] = frame_num
+            (w, h) = sizes[i]
+            plan.crop[n, i] = video_crop.crop_rect(v, crop, w, h,
+                                                   v.size_w, v.size_h,
+                                                   frame_num / plan.fps[i],
+                                                   face_scales[i],
+                                                   grid.cell_landscape,
+                                                   use_faces[i])
+    log("render plan:", len(times), "frames,", int(plan.drawn.sum()),
+        "videos")
+    return plan
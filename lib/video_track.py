@@ -1,11 +1,20 @@
 import cv2
 import json
+import numpy as np
 import os
+import queue
 import skvideo.io               # pip install sk-video
+import threading
 
 from .logger import log
 from .video_face_dlib import FaceDetect
 
+# decoded frames each track's reader thread keeps ready ahead of time
+prefetch_frames = 4
+# sec decoded ahead of a seek target (the frame rate conversion needs
+# to see the frames around it)
+seek_preroll = 0.5
+
 class VideoTrack:
     def __init__(self):
         self.file = None
@@ -18,11 +27,34 @@ class VideoTrack:
         self.sort_order = 999999
         self.frame = []
         self.raw_frame = None
+        # raw_id changes whenever raw_frame does (raw_source is the
+        # frame number and rotation it came from)
+        self.raw_id = 0
+        self.raw_source = None
         self.shaped_frame = None
+        self.shaped_key = None
+        # scratch arrays the shaping reuses from frame to frame
+        self.buffers = {}
         self.face = FaceDetect()
         self.local_time = 0.0
+        self.frames = None
+        self.thread = None
+        self.stop = False
+        self.probed = False
+        # decoded frame size / display size, and the rotation ffmpeg
+        # already did for us
+        self.scale = 1.0
+        self.decode_rotate = 0
 
     def open(self, file):
+        if not self.probe(file):
+            return False
+        self.start()
+        return True
+
+    # read the video stats (display size, fps, duration), don't start
+    # decoding yet
+    def probe(self, file):
         self.file = file
         print("video:", file)
         metadata = skvideo.io.ffprobe(file)
@@ -64,6 +96,7 @@ class VideoTrack:
         codec = metadata['video']['@codec_long_name']
         self.w = int(metadata['video']['@width'])
         self.h = int(metadata['video']['@height'])
+        self.coded_w = self.w
         if '@sample_aspect_ratio' in metadata['video']:
             num, den = metadata['video']['@sample_aspect_ratio'].split(':')
             if int(den) > 0:
@@ -84,37 +117,159 @@ class VideoTrack:
         print('codec:', codec)
         print('output size:', self.w, 'x', self.h)
         print('total frames:', self.total_frames)
-
-        print("Opening ", file)
-        self.reader = skvideo.io.FFmpegReader(file, inputdict={}, outputdict={})
-        self.get_frame(0.0)     # read first frame
-        if self.frame is None:
-            log("warning: no first frame in:", file)
+        self.probed = True
         return True
 
+    # start decoding.  ffmpeg does the scaling (scale is relative to
+    # the display size), aspect ratio correction, rotation and frame
+    # rate reduction (to fps), and hands us bgr frames, so we never
+    # pipe or touch more pixels than the render needs.  A start_time
+    # seeks to the frame at that (local) time first.
+    def start(self, scale=1.0, rotate=0, fps=None, start_time=0):
+        filters = []
+        inputdict = {}
+        if self.decode_fps(fps) != self.fps:
+            # drop the frames the output would skip anyway
+            filters.append("fps=%g" % fps)
+            self.fps = fps
+            self.total_frames = int(round(self.duration * self.fps))
+        start_frame = int(round(start_time * self.fps))
+        if start_frame > 0:
+            # seek a bit ahead of the frame, put the timestamps back
+            # where a decode from the start has them (so the frame rate
+            # conversion picks the same frames), then cut exactly at it
+            seek = max(start_frame / self.fps - seek_preroll, 0)
+            if seek > 0:
+                inputdict["-ss"] = "%.3f" % seek
+                filters.insert(0, "setpts=PTS+%.3f/TB" % seek)
+            filters.append("trim=start=%.6f" % ((start_frame - 0.5) / self.fps))
+            self.frame_counter = start_frame - 1
+        (w, h) = self.decode_size(scale)
+        self.scale = w / self.w
+        if w != self.coded_w or h != self.h:
+            filters.append("scale=%d:%d" % (w, h))
+        filters.append("setsar=1")
+        if rotate == 90:
+            filters.append("transpose=clock")
+        elif rotate == 180:
+            filters += [ "hflip", "vflip" ]
+        elif rotate == 270:
+            filters.append("transpose=cclock")
+        if rotate in [ 90, 180, 270 ]:
+            self.decode_rotate = rotate
+        if self.decode_rotate in [ 90, 270 ]:
+            (w, h) = (h, w)
+        outputdict = { "-vf": ",".join(filters),
+                       "-sws_flags": "area",
+                       "-pix_fmt": "bgr24",
+                       "-s": "%dx%d" % (w, h) }
+        print("Opening ", self.file, inputdict, outputdict)
+        self.reader = skvideo.io.FFmpegReader(self.file, inputdict=inputdict,
+                                              outputdict=outputdict)
+        self.start_reader()
+        self.get_frame(start_time)  # read first frame
+        if self.frame is None and start_frame > 0:
+            # seeked past the end: by the end of the pre-roll, a render
+            # that went through the whole track has faded it to black
+            self.raw_frame = np.zeros(shape=[h, w, 3], dtype=np.uint8)
+        elif self.frame is None:
+            log("warning: no first frame in:", self.file)
+
+    # frame rate start() decodes at for an output at fps
+    def decode_fps(self, fps=None):
+        if fps is not None and self.fps > fps * 1.01:
+            return fps
+        return self.fps
+
+    # size of the frames start() decodes (after rotation)
+    def decode_size(self, scale=1.0, rotate=0):
+        if scale > 1:
+            scale = 1
+        w = max(int(round(self.w * scale / 2)) * 2, 2)
+        h = max(int(round(self.h * scale / 2)) * 2, 2)
+        if rotate in [ 90, 270 ]:
+            (w, h) = (h, w)
+        return (w, h)
+
+    # decode frames on a background thread into a small bounded buffer,
+    # so the ffmpeg pipes of all the tracks are read at the same time
+    # instead of one after another by the render loop
+    def start_reader(self):
+        self.frames = queue.Queue(maxsize=prefetch_frames)
+        self.stop = False
+        self.thread = threading.Thread(target=self.reader_thread, daemon=True)
+        self.thread.start()
+
+    def reader_thread(self):
+        while not self.stop:
+            frame = self.decode_frame()
+            while not self.stop:
+                try:
+                    self.frames.put(frame, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if frame is None:
+                break
+
+    # next frame from the ffmpeg pipe, None at the end
+    def decode_frame(self):
+        try:
+            frame = self.reader._readFrame()
+        except:
+            return None
+        if not len(frame):
+            return None
+        return frame
+
+    def read_frame(self):
+        if self.frames is None:
+            return self.decode_frame()
+        if self.thread is None or not self.thread.is_alive():
+            # the end was reached (don't wait on an empty buffer)
+            try:
+                return self.frames.get_nowait()
+            except queue.Empty:
+                return None
+        return self.frames.get()
+
+    def close(self):
+        if self.thread is not None:
+            self.stop = True
+            self.thread.join()
+            self.thread = None
+            self.frames = None
+        if self.reader is not None:
+            self.reader.close()
+
     def get_frame(self, local_time, rotate=0):
         # return the frame closest to the requested time
         frame_num = int(round(local_time * self.fps))
         if frame_num < 0:
-            self.raw_frame = None
             self.local_time = 0.0
+        elif self.frame_counter < frame_num and not self.frame is None:
+            self.local_time = local_time
+        self.get_frame_num(frame_num, rotate)
+
+    # read ahead to frame number frame_num (raw_frame is None before
+    # the first frame)
+    def get_frame_num(self, frame_num, rotate=0):
+        if frame_num < 0:
+            if self.raw_frame is not None:
+                self.raw_frame = None
+                self.raw_id += 1
             return
         while self.frame_counter < frame_num and not self.frame is None:
-            try:
-                self.frame = self.reader._readFrame()
-                self.frame = self.frame[:,:,::-1]
-                if not self.displayw is None:
-                    self.frame = cv2.resize(self.frame, (self.displayw, self.h),
-                                            interpolation=cv2.INTER_AREA)
-                self.local_time = local_time
-                self.frame_counter += 1
-                if not len(self.frame):
-                    self.frame = None
-                #else:
-            except:
-                self.frame = None
+            self.frame = self.read_frame()
+            self.frame_counter += 1
         if self.frame is not None:
             #cv2.imshow("before", self.frame)
+            rotate = (rotate - self.decode_rotate) % 360
+            if self.raw_source == (self.frame_counter, rotate):
+                # still the same frame
+                return
+            self.raw_source = (self.frame_counter, rotate)
+            self.raw_id += 1
             if rotate == 0:
                 self.raw_frame = self.frame
             elif rotate == 90:
@@ -129,9 +284,10 @@ class VideoTrack:
                 print("unhandled rotation angle:", rotate)
             #cv2.imshow("after", self.raw_frame)
         else:
-            # no more frames, impliment a simple fade out
-            if self.raw_frame is not None:
+            # no more frames, impliment a simple fade out (until black)
+            if self.raw_frame is not None and self.raw_frame.any():
                 self.raw_frame = (self.raw_frame * 0.9).astype('uint8')
+                self.raw_id += 1
 
     def find_face(self):
         result = self.face.find_face(self.raw_frame)
@@ -147,16 +303,9 @@ class VideoTrack:
         skip_frames = int(round( seconds * self.fps ))
         print("skipping first %.2f seconds (%d frames.)" % (seconds, skip_frames))
         for i in range(skip_frames):
-            self.reader._readFrame()
+            self.read_frame()
 
     # deprecated?
     def next_frame(self):
-        try:
-            frame = self.reader._readFrame()
-        except:
-            return None
-        if not len(frame):
-            return None
-        frame = frame[:,:,::-1]     # convert from RGB to BGR (to make opencv happy)
-        return frame
+        return self.read_frame()
 
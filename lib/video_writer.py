@@ -0,0 +1,75 @@
+# the output video encoder: bgr frames are piped straight into one
+# ffmpeg process that also takes the final audio mix as an input, so
+# the video is encoded and muxed with its audio in a single pass (no
+# silent intermediate file to remux.)
+
+import numpy as np
+import subprocess
+
+from .logger import log
+
+# x264 settings, see all options: https://trac.ffmpeg.org/wiki/Encode/H.264
+presets = [ "ultrafast", "superfast", "veryfast", "faster", "fast",
+            "medium", "slow", "slower", "veryslow" ]
+tunes = [ "film", "animation", "grain", "stillimage", "fastdecode",
+          "zerolatency" ]
+preset = "medium"               # default compression
+crf = 17                        # visually lossless (or nearly so)
+threads = None                  # ffmpeg's choice (about all cpus)
+tune = None
+
+# room for the audio packets the muxer holds while x264 fills its
+# lookahead before the first video packet comes out
+muxing_queue = 1024
+
+# x264 encoder arguments, encoder may override the module settings
+# (missing or None keeps the default)
+def x264_args(fps, encoder={}):
+    def setting(key, default):
+        value = encoder.get(key)
+        if value is None:
+            return default
+        return value
+    args = [ "-c:v", "libx264",
+             "-pix_fmt", "yuv420p", # support 'dumb' players
+             "-crf", str(setting("crf", crf)),
+             "-preset", setting("preset", preset) ]
+    if setting("tune", tune) is not None:
+        args += [ "-tune", setting("tune", tune) ]
+    if setting("threads", threads) is not None:
+        args += [ "-threads", str(setting("threads", threads)) ]
+    return args + [ "-r", str(fps) ]
+
+class VideoWriter:
+    # w x h bgr frames at fps into output_file, with the audio of
+    # audio_file (aac) if given
+    def __init__(self, output_file, w, h, fps, audio_file=None, encoder={}):
+        self.output_file = output_file
+        self.shape = (h, w, 3)
+        command = [ "ffmpeg", "-y", "-loglevel", "error",
+                    "-f", "rawvideo", "-pix_fmt", "bgr24",
+                    "-s", "%dx%d" % (w, h), "-r", str(fps),
+                    "-i", "pipe:0" ]
+        if audio_file is not None:
+            command += [ "-i", audio_file,
+                         "-map", "0:v:0", "-map", "1:a:0",
+                         "-c:a", "aac",
+                         "-max_muxing_queue_size", str(muxing_queue) ]
+        command += x264_args(fps, encoder) + [ output_file ]
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    # write one frame (the frame's memory goes to the pipe as is, no
+    # copy when it is contiguous)
+    def write(self, frame):
+        if frame.shape != self.shape:
+            raise ValueError("frame shape %s, expected %s" % (frame.shape, self.shape))
+        self.proc.stdin.write(np.ascontiguousarray(frame).data)
+
+    # finish the encode (blocks until ffmpeg is done)
+    def close(self):
+        self.proc.stdin.close()
+        result = self.proc.wait()
+        if result != 0:
+            log("video encode failed:", self.output_file,
+                "ffmpeg result code:", result)
+            raise RuntimeError("encoding the video failed")
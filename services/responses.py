@@ -8,6 +8,8 @@ import tempfile
 import time
 from zipfile import ZipFile
 
+from lib import pipeline
+
 from . import common
 from . import gdrive
 
@@ -22,10 +24,15 @@ def fetch( response_url ):
         f.write(csv_data)
         f.close()
 
-def process( settings ):
+# jobs run on the pool of warm workers when given (see workers.py), all
+# the new rows are handed to it at once and run as many at a time as
+# there are workers.  Otherwise they run one by one right here in the
+# daemon process.
+def process( settings, pool=None ):
     last_time = get_last_time()
     new_time = 0
     dirty = False
+    pending = {}                # pool job id -> (request, job)
     csvfile = os.path.join(common.vcdir, "responses.csv")
     with open(csvfile, 'r') as f:
         reader = csv.DictReader(f)
@@ -41,9 +48,25 @@ def process( settings ):
                 dirty = True
                 if ts > new_time:
                     new_time = ts
-                result = run_job(settings, row)
-                if not result:
+                if pool is None:
+                    result = run_job(settings, row)
+                    if not result:
+                        print("Error processing job, sorry ...")
+                    continue
+                # one job per project folder at a time (the folder sync
+                # would pull files out from under the running job)
+                url = row['Public google drive folder share link']
+                while url in [ r['Public google drive folder share link']
+                               for (r, job) in pending.values() ]:
+                    collect(settings, pool, pending)
+                job = prepare_job(settings, row)
+                if job is None:
                     print("Error processing job, sorry ...")
+                    continue
+                print("Submitting job:", job["args"])
+                pending[pool.submit(job["args"])] = (row, job)
+    while len(pending):
+        collect(settings, pool, pending)
     if dirty:
         save_last_time(new_time)        
 
@@ -108,21 +131,44 @@ def gen_form_error(settings, request):
         return False
     return True
 
-def run_job(settings, request):
+# wait for whichever pending pool job finishes first and send its
+# results
+def collect(settings, pool, pending):
+    def progress(job_id, line):
+        print("[job %d]" % job_id, line)
+    job_id, result = pool.wait_any(list(pending), progress)
+    (request, job) = pending.pop(job_id)
+    if not finish_job(settings, request, job, result):
+        print("Error processing job, sorry ...")
+
+def run_job(settings, request, pool=None):
+    job = prepare_job(settings, request)
+    if job is None:
+        return False
+    print("Running job:", job["args"])
+    if pool is None:
+        result = pipeline.run(job["args"])
+    else:
+        result = pool.run(job["args"], progress=lambda id, line: print(line))
+    return finish_job(settings, request, job, result)
+
+# sync the request's folder and work out the pipeline options, returns
+# the job (None if the request can't run, the error report is sent)
+def prepare_job(settings, request):
     # sync the shared google drive folder (create a local copy)
     url = request['Public google drive folder share link']
     if not "google.com" in url:
         print("this doesn't look like a google drive url.")
         print("aborting...")
         gen_form_error(settings, request)
-        return False
+        return None
     
     gd = gdrive.gdrive()
     result = gd.sync_folder(url)
     if not result:
         print("sync failed, permissions or url?")
         gen_sync_error(settings, request)
-        return False
+        return None
 
     # paths management
     folder_id = gd.get_folder_id(url)
@@ -134,61 +180,60 @@ def run_job(settings, request):
     
     audio_only = False
     aligned_tracks = False
-    command = [ "./sync-tracks.py", work_dir ]
+    options = {}
     if request['Synchronization Strategy'] == "Claps":
-        command.append( "--sync" )
-        command.append( "clap" )
+        options["sync"] = "clap"
     if len(request['Additional Options']):
-        options = request['Additional Options'].split(", ")
-        for o in options:
+        for o in request['Additional Options'].split(", "):
             if o.lower().startswith("suppress noise"):
-                command.append("--suppress-noise")
+                options["suppress_noise"] = True
             elif o.lower().startswith("dynamic range compression"):
-                command.append("--compression")
+                options["compression"] = True
             elif o.lower().startswith("make individual time aligned tracks"):
                 aligned_tracks = True
-                command.append("--write-aligned-tracks")
+                options["write_aligned_tracks"] = True
     if len(request['Video Options']):
-        options = request['Video Options'].split(", ")
-        for o in options:
+        for o in request['Video Options'].split(", "):
             if o.lower().startswith("no video"):
                 audio_only = True
-                command.append("--no-video")
+                options["no_video"] = True
             elif o.lower().startswith("mute videos"):
-                command.append("--mute-videos")
+                options["mute_videos"] = True
     if len(request['Video Resolution']):
         if request['Video Resolution'].startswith("720p"):
-            command.append("--resolution")
-            command.append("720p")
+            options["resolution"] = "720p"
         elif request['Video Resolution'].startswith("1080p"):
-            command.append("--resolution")
-            command.append("1080p")
+            options["resolution"] = "1080p"
         elif request['Video Resolution'].startswith("1440p"):
-            command.append("--resolution")
-            command.append("1440p")
+            options["resolution"] = "1440p"
     if len(request["Specify Number of Video Rows"]):
-        command.append("--rows")
-        command.append(str(int(request["Specify Number of Video Rows"])))
+        options["rows"] = int(request["Specify Number of Video Rows"])
     if len(request["Crop/Zoom Strategy"]):
         if request["Crop/Zoom Strategy"].startswith("Find Faces"):
-            command.append("--crop")
-            command.append("face")
+            options["crop"] = "face"
         elif request["Crop/Zoom Strategy"].startswith("Best fit"):
-            command.append("--crop")
-            command.append("fit")
+            options["crop"] = "fit"
         elif request["Crop/Zoom Strategy"].startswith("None"):
-            command.append("--crop")
-            command.append("none")
- 
-    print("Running command:", command)
-    result = subprocess.run(command)
-    if result.returncode != 0:
+            options["crop"] = "none"
+
+    return { "args": pipeline.options(work_dir, **options),
+             "work_dir": work_dir,
+             "results_dir": results_dir,
+             "folder_name": gd.folder_name,
+             "audio_only": audio_only,
+             "aligned_tracks": aligned_tracks }
+
+# send the results of a finished job (result is the pipeline's)
+def finish_job(settings, request, job, result):
+    work_dir = job["work_dir"]
+    results_dir = job["results_dir"]
+    if not result:
         print("Something failed processing the job.")
         return False
 
     if False:
         # zip the results
-        zip_file = os.path.join(work_dir, gd.folder_name + ".zip")
+        zip_file = os.path.join(work_dir, job["folder_name"] + ".zip")
         result_files = [ "mixed_audio.mp3",
                          "gridded_video.mp4",
                          "audacity_import.lof" ]
@@ -203,9 +248,9 @@ def run_job(settings, request):
     file_list = []
     file_list += Path(work_dir).glob("*-mix.mp3")
     file_list += Path(work_dir).rglob("*_audacity_import.lof")
-    if aligned_tracks:
+    if job["aligned_tracks"]:
         file_list += Path(results_dir).glob("aligned_*")
-    if not audio_only:
+    if not job["audio_only"]:
         file_list += Path(results_dir).glob("gridded_video.mp4")
     file_list += Path(results_dir).glob("full-mix.mp3")
     file_list += Path(results_dir).glob("report.txt")
@@ -214,7 +259,7 @@ def run_job(settings, request):
     if "Song Name" in request and len(request["Song Name"]):
         song_name = request["Song Name"]
     else:
-        song_name = gd.folder_name
+        song_name = job["folder_name"]
     subject = "'Your virtual choir song: " + song_name + " is ready!'"
     result = send_results(settings, request, subject, file_list)
     if not result:
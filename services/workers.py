@@ -0,0 +1,121 @@
+# pre-warmed pipeline worker processes for the job daemon.  Each worker
+# imports the pipeline and the heavy libraries behind it once at start
+# up, then runs jobs in-process and streams its log lines back as
+# progress.  Workers are not daemonic because the pipeline stages start
+# their own worker processes.
+
+import importlib
+import itertools
+import multiprocessing
+import queue
+import traceback
+
+# slow imports the pipeline stages would otherwise pay on every job
+prewarm = [ "librosa", "scipy.signal", "cv2", "skvideo.io" ]
+
+def worker(jobs, progress):
+    from lib import logger
+    from lib import pipeline
+    for name in prewarm:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            print("worker: cannot prewarm:", name)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        (job_id, args) = job
+        progress.put( ("start", job_id, multiprocessing.current_process().pid) )
+        def listener(line):
+            progress.put( ("log", job_id, line) )
+        logger.listeners.append(listener)
+        try:
+            result = pipeline.run(args)
+        except BaseException:
+            # quit() in the pipeline lands here too
+            progress.put( ("log", job_id, traceback.format_exc()) )
+            result = False
+        logger.listeners.remove(listener)
+        progress.put( ("done", job_id, result) )
+
+class WorkerPool:
+    def __init__(self, count=1):
+        self.ctx = multiprocessing.get_context("fork")
+        self.jobs = self.ctx.Queue()
+        self.progress = self.ctx.Queue()
+        self.counter = itertools.count(1)
+        self.running = {}       # pid -> job id
+        self.results = {}       # job id -> True/False
+        self.procs = []
+        for i in range(count):
+            self.start_worker()
+
+    def start_worker(self):
+        proc = self.ctx.Process(target=worker,
+                                args=(self.jobs, self.progress),
+                                daemon=False)
+        proc.start()
+        self.procs.append(proc)
+
+    # queue up a pipeline run (see pipeline.options()), returns a job id
+    def submit(self, args):
+        job_id = next(self.counter)
+        self.jobs.put( (job_id, args) )
+        return job_id
+
+    # replace workers that died (out of memory?), their job failed
+    def check_workers(self):
+        for proc in list(self.procs):
+            if proc.is_alive():
+                continue
+            print("worker died, exit code:", proc.exitcode)
+            self.procs.remove(proc)
+            if proc.pid in self.running:
+                self.results[self.running.pop(proc.pid)] = False
+            self.start_worker()
+
+    # handle the next message from the workers (or check on them after
+    # a second without one), progress(job_id, line) is called for log
+    # lines
+    def poll(self, progress=None):
+        try:
+            (kind, id, data) = self.progress.get(timeout=1)
+        except queue.Empty:
+            self.check_workers()
+            return
+        if kind == "start":
+            self.running[data] = id
+        elif kind == "log":
+            if progress:
+                progress(id, data)
+        elif kind == "done":
+            for pid in list(self.running):
+                if self.running[pid] == id:
+                    del self.running[pid]
+            self.results[id] = data
+
+    # block until the job is finished, progress(job_id, line) is called
+    # for every log line of every job meanwhile.  Returns True on success.
+    def wait(self, job_id, progress=None):
+        while not job_id in self.results:
+            self.poll(progress)
+        return self.results.pop(job_id)
+
+    # block until any of the jobs is finished, returns (job_id, result)
+    def wait_any(self, job_ids, progress=None):
+        while True:
+            for job_id in job_ids:
+                if job_id in self.results:
+                    return job_id, self.results.pop(job_id)
+            self.poll(progress)
+
+    def run(self, args, progress=None):
+        return self.wait(self.submit(args), progress)
+
+    def close(self):
+        for proc in self.procs:
+            self.jobs.put(None)
+        for proc in self.procs:
+            proc.join()
+        self.procs = []
@@ -9,11 +9,15 @@ import urllib.request
 from services import common
 # from services import filemail
 from services import responses
+from services import workers
 
 settings = common.get_config()
 
+# warm pipeline workers (imports done once, not per job)
+pool = workers.WorkerPool( settings.get("workers", 1) )
+
 # process any pending jobs on startup
-responses.process( settings )
+responses.process( settings, pool )
 
 # watch the inbox for form submissions (or edits)
 # imap host, username & password are stored externally as a json file.
@@ -47,7 +51,7 @@ while True:
         if form_notification:
             print("new google form work ...")
             responses.fetch( settings["responses"] )
-            responses.process( settings )
+            responses.process( settings, pool )
         
     # subjects = [msg.subject for msg in mailbox.fetch(AND(all=True))]
     time.sleep(settings["interval"])